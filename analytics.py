@@ -0,0 +1,165 @@
+# analytics.py
+#
+# Aggregates behind the admin Analytics page. They are computed from the
+# Parquet snapshot written by export.py, not from live Firestore reads: only
+# the needed columns are read, ids are dictionary-encoded, and every metric
+# is a vectorized pandas/NumPy reduction. Millions of recitations reduce to a
+# few small tables, which the page caches per snapshot.
+
+import datetime
+import functools
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from export import EXPORTS, STATE_FILE
+
+EXPORT_DIR = os.getenv("EXPORT_DIR", "exports")
+
+
+# Snapshot version, which changes whenever export.py finishes a collection
+def snapshot_version(export_dir=EXPORT_DIR):
+    path = os.path.join(export_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    return os.path.getmtime(path)
+
+
+# Time of the last export of a collection (the snapshot's "now")
+def snapshot_time(export_dir, collection):
+    path = os.path.join(export_dir, STATE_FILE)
+    if os.path.exists(path):
+        with open(path) as f:
+            state = json.load(f)
+        if collection in state:
+            exported = state[collection]
+            # Older state files only recorded the watermark
+            return pd.Timestamp(exported.get("exported_at", exported["watermark"]))
+    return pd.Timestamp.now(tz="UTC")
+
+
+# Read selected columns of an exported collection across all partitions.
+# Incremental and --full runs re-export documents, so only the latest row
+# per key is kept. Keying large collections on data columns instead of the
+# document id avoids materializing millions of id strings.
+def load_table(export_dir, collection, columns, key=("id",), latest_by=None):
+    path = os.path.join(export_dir, collection)
+    columns = list(dict.fromkeys([*key, *columns]))
+    if not os.path.isdir(path):
+        schema = EXPORTS[collection]["schema"]
+        return schema.empty_table().select(columns).to_pandas()
+    # Reading with the declared schema fills columns missing from older
+    # exports with nulls; user ids are dictionary-encoded while reading
+    schema = EXPORTS[collection]["schema"]
+    for index, field in enumerate(schema):
+        if field.name.endswith("_id"):
+            schema = schema.set(
+                index, field.with_type(pa.dictionary(pa.int32(), pa.string()))
+            )
+    read = functools.partial(
+        pq.read_table, path, columns=columns, schema=schema, partitioning="hive"
+    )
+    try:
+        table = read()
+    except FileNotFoundError:
+        # A full export removed a superseded file while it was being listed
+        table = read()
+    frame = table.to_pandas()
+    if latest_by is not None:
+        frame = frame.sort_values(latest_by, kind="stable", na_position="first")
+    return frame.drop_duplicates(list(key), keep="last")
+
+
+# Recitations and distinct reciting users per UTC day, including empty days
+def daily_activity(recitations):
+    recitations = recitations[recitations["recited_at"].notna()]
+    if recitations.empty:
+        return pd.DataFrame(
+            {
+                "date": pd.Series(dtype="datetime64[ns]"),
+                "recitations": pd.Series(dtype=np.int64),
+                "active_users": pd.Series(dtype=np.int64),
+            }
+        )
+    days = pd.DataFrame(
+        {
+            "date": recitations["recited_at"].dt.tz_convert(None).dt.floor("D"),
+            "user": recitations["user_id"].cat.codes.to_numpy(),
+        }
+    )
+    daily = days.groupby("date").agg(
+        recitations=("user", "size"), active_users=("user", "nunique")
+    )
+    full_range = pd.date_range(daily.index.min(), daily.index.max(), freq="D")
+    daily = daily.reindex(full_range, fill_value=0).rename_axis("date")
+    return daily.reset_index()
+
+
+# Number of friend pairs per streak length, for current and longest streaks.
+# A current streak whose last mutual UTC day is before yesterday (at snapshot
+# time) has expired, as in models.streak_is_current.
+def streak_distribution(streaks, as_of):
+    last_day = streaks["last_mutual_recitation"].dt.floor("D")
+    yesterday = as_of.floor("D") - pd.Timedelta(days=1)
+    active = (last_day.notna() & (last_day >= yesterday)).to_numpy()
+    current = streaks["current_streak"].fillna(0).to_numpy(np.int64)
+    current = current[active & (current > 0)]
+    longest = streaks["longest_streak"].fillna(0).to_numpy(np.int64)
+    longest = longest[longest > 0]
+    size = int(max(current.max(initial=0), longest.max(initial=0))) + 1
+    distribution = pd.DataFrame(
+        {
+            "streak_length": np.arange(size),
+            "current": np.bincount(current, minlength=size),
+            "longest": np.bincount(longest, minlength=size),
+        }
+    )
+    return distribution.iloc[1:].reset_index(drop=True)
+
+
+# Number of users per friend count, including users without friends
+def friend_degree_distribution(friendships, user_count):
+    ends = np.concatenate(
+        [
+            friendships["user1_id"].astype(object).to_numpy(),
+            friendships["user2_id"].astype(object).to_numpy(),
+        ]
+    )
+    _, degrees = np.unique(ends, return_counts=True)
+    counts = np.bincount(degrees, minlength=1)
+    counts[0] = max(user_count - len(degrees), 0)
+    distribution = pd.DataFrame({"friends": np.arange(len(counts)), "users": counts})
+    return distribution[distribution["users"] > 0].reset_index(drop=True)
+
+
+# All page aggregates for the snapshot in export_dir
+def compute_analytics(export_dir=EXPORT_DIR):
+    users = load_table(export_dir, "users", ["updated_at"], latest_by="updated_at")
+    friendships = load_table(export_dir, "friendships", ["user1_id", "user2_id"])
+    streaks = load_table(
+        export_dir,
+        "streaks",
+        ["current_streak", "longest_streak", "last_mutual_recitation", "updated_at"],
+        latest_by="updated_at",
+    )
+    # Re-exported recitations repeat the same user and timestamp
+    recitations = load_table(
+        export_dir, "recitations", [], key=("user_id", "recited_at")
+    )
+    streak_lengths = streak_distribution(streaks, snapshot_time(export_dir, "streaks"))
+    return {
+        "daily": daily_activity(recitations),
+        "streaks": streak_lengths,
+        "friend_degrees": friend_degree_distribution(friendships, len(users)),
+        "totals": {
+            "users": len(users),
+            "friendships": len(friendships),
+            "recitations": len(recitations),
+            "active_streaks": int(streak_lengths["current"].sum()),
+        },
+        "computed_at": datetime.datetime.now(datetime.timezone.utc),
+    }
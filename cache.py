@@ -0,0 +1,251 @@
+# cache.py
+
+import datetime
+import functools
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+# Channel used to broadcast invalidations between server replicas
+INVALIDATION_CHANNEL = "quran_recitation_app/invalidate"
+
+# Sentinel returned by backends on a cache miss (None is a valid cached value)
+MISSING = object()
+
+# Classes that may be stored in a shared cache, by name. Values are written as
+# JSON rather than pickled, so anyone able to write to Redis can't make the
+# replicas run code; registered classes provide to_dict() and from_dict().
+SERIALIZABLE_TYPES = {}
+
+
+def serializable(cls):
+    SERIALIZABLE_TYPES[cls.__name__] = cls
+    return cls
+
+
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return {"__datetime__": value.isoformat()}
+    name = type(value).__name__
+    if SERIALIZABLE_TYPES.get(name) is type(value):
+        return {"__type__": name, "fields": value.to_dict()}
+    raise TypeError(f"Cannot cache values of type {name}")
+
+
+def _decode(obj):
+    if "__datetime__" in obj:
+        return datetime.datetime.fromisoformat(obj["__datetime__"])
+    if "__type__" in obj:
+        cls = SERIALIZABLE_TYPES.get(obj["__type__"])
+        if cls is None:
+            raise ValueError(f"Unknown cached type {obj['__type__']!r}")
+        return cls.from_dict(obj["fields"])
+    return obj
+
+
+def dumps(value):
+    return json.dumps(value, default=_encode)
+
+
+def loads(raw):
+    return json.loads(raw, object_hook=_decode)
+
+
+# Base Cache Backend
+class CacheBackend:
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def invalidate(self, *keys):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+# In-Process Cache (single replica, or near-cache in front of Redis)
+class InProcessCache(CacheBackend):
+    def __init__(self, default_ttl=300, max_entries=10000):
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return MISSING
+            # Mark as recently used
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            # Evict least recently used entries
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Redis Cache (shared across replicas, invalidations fanned out via pub/sub)
+class RedisCache(CacheBackend):
+    def __init__(
+        self,
+        url=None,
+        client=None,
+        default_ttl=300,
+        near_cache_ttl=30,
+        channel=INVALIDATION_CHANNEL,
+    ):
+        if client is None:
+            import redis  # Only required when a Redis URL is configured
+
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.default_ttl = default_ttl
+        self.channel = channel
+        # Small per-replica cache to avoid a network hop on hot keys
+        self.near_cache = (
+            InProcessCache(default_ttl=near_cache_ttl) if near_cache_ttl else None
+        )
+        self._pubsub = None
+        self._listener = None
+        if self.near_cache is not None:
+            self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            self._pubsub.subscribe(**{self.channel: self._on_invalidate})
+            self._listener = self._pubsub.run_in_thread(
+                sleep_time=0.1, daemon=True, exception_handler=self._on_listener_error
+            )
+
+    def _on_invalidate(self, message):
+        try:
+            keys = json.loads(message["data"])
+        except (TypeError, ValueError):
+            logging.warning(f"Ignoring malformed cache invalidation: {message!r}")
+            return
+        self.near_cache.invalidate(*keys)
+
+    def _on_listener_error(self, error, pubsub, thread):
+        # Invalidations may have been missed, so drop everything held locally
+        logging.error(f"Cache invalidation listener error: {error}")
+        self.near_cache.clear()
+
+    def get(self, key):
+        if self.near_cache is not None:
+            value = self.near_cache.get(key)
+            if value is not MISSING:
+                return value
+        try:
+            raw = self.client.get(key)
+        except Exception as e:
+            logging.error(f"Error reading cache key {key}: {e}")
+            return MISSING
+        if raw is None:
+            return MISSING
+        try:
+            value = loads(raw)
+        except (TypeError, ValueError) as e:
+            logging.warning(f"Ignoring undecodable cache entry {key}: {e}")
+            return MISSING
+        if self.near_cache is not None:
+            self.near_cache.set(key, value)
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        try:
+            self.client.set(key, dumps(value), ex=ttl)
+        except Exception as e:
+            logging.error(f"Error writing cache key {key}: {e}")
+            return
+        if self.near_cache is not None:
+            self.near_cache.set(key, value, min(ttl, self.near_cache.default_ttl))
+
+    def invalidate(self, *keys):
+        if not keys:
+            return
+        if self.near_cache is not None:
+            self.near_cache.invalidate(*keys)
+        try:
+            self.client.delete(*keys)
+            self.client.publish(self.channel, json.dumps(list(keys)))
+        except Exception as e:
+            logging.error(f"Error invalidating cache keys {keys}: {e}")
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.stop()
+        if self._pubsub is not None:
+            self._pubsub.close()
+
+
+# Build a backend from a URL ("redis://..." or "rediss://..."), else in-process
+def create_cache(url=None, default_ttl=300):
+    if url and url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisCache(url=url, default_ttl=default_ttl)
+    return InProcessCache(default_ttl=default_ttl)
+
+
+# Build a cache key from a prefix and arguments
+def cache_key(prefix, *args):
+    return ":".join([prefix, *(str(arg) for arg in args)])
+
+
+# Memoize a function's result in a cache backend (None results are not cached).
+# With stale_ttl, entries outlive ttl and are served when the function fails,
+# so reads degrade to slightly old data instead of erroring.
+def memoize(backend, prefix, ttl=None, stale_ttl=None):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            key = cache_key(prefix, *args)
+            value = backend.get(key)
+            if stale_ttl is None:
+                if value is not MISSING:
+                    return value
+                value = func(*args)
+                if value is not None:
+                    backend.set(key, value, ttl)
+                return value
+
+            if value is not MISSING:
+                fresh_until, cached = value
+                if fresh_until > time.time():
+                    return cached
+            try:
+                result = func(*args)
+            except Exception as e:
+                if value is MISSING:
+                    raise
+                logging.warning(f"Serving stale {key} after error: {e!r}")
+                return cached
+            if result is not None:
+                fresh_for = backend.default_ttl if ttl is None else ttl
+                backend.set(key, (time.time() + fresh_for, result), stale_ttl)
+            return result
+
+        wrapper.cache_key = functools.partial(cache_key, prefix)
+        return wrapper
+
+    return decorator
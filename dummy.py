@@ -3,6 +3,7 @@
 import bcrypt
 from google.cloud import firestore
 import datetime
+from streaks import recompute_streaks
 
 
 # Initialize Firestore Client
@@ -38,6 +39,7 @@ def create_user(username, email, password):
         "email": email,
         "password_hash": password_hashed,
         "created_at": datetime.datetime.utcnow(),
+        "updated_at": datetime.datetime.utcnow(),
         "last_recitation_time": None,  # Initialize as None
     }
     user_ref = users_ref.add(user_doc)
@@ -97,71 +99,29 @@ def create_recitation(user_id, date=None):
         if isinstance(date, datetime.date) and not isinstance(date, datetime.datetime):
             date = datetime.datetime.combine(date, datetime.time())
     # Update user's last_recitation_time
-    users_ref.update({"last_recitation_time": date})
-    # Check if recitation already exists for the date using keyword arguments
-    query = (
-        recitations_ref.where(field_path="user_id", op_string="==", value=user_id)
-        .where(field_path="date", op_string="==", value=date)
-        .limit(1)
-        .stream()
+    users_ref.update(
+        {"last_recitation_time": date, "updated_at": datetime.datetime.utcnow()}
     )
-    if any(True for _ in query):
+    # Recitations are keyed by user and day, matching utils.recitation_id
+    recitation_ref = recitations_ref.document(f"{user_id}_{date:%Y%m%d}")
+    if recitation_ref.get().exists:
         print(f"Recitation for user '{user_id}' on '{date}' already exists. Skipping.")
         return
     # Create recitation
     recitation_data = {
         "user_id": user_id,
-        "date": date,  # Stored as datetime.datetime
+        "date": datetime.datetime.combine(date.date(), datetime.time()),
         "recited_at": date,
+        "completed": True,
     }
-    recitations_ref.add(recitation_data)
+    recitation_ref.set(recitation_data)
     print(f"Recitation for user '{user_id}' on '{date}' created.")
 
 
 # Update Streaks based on existing recitations
 def update_streaks():
-    streaks_ref = db.collection("streaks").stream()
-    for streak_doc in streaks_ref:
-        streak = streak_doc.to_dict()
-        user1_id = streak["user1_id"]
-        user2_id = streak["user2_id"]
-        # Fetch users' last_recitation_time
-        user1_doc = db.collection("users").document(user1_id).get()
-        user2_doc = db.collection("users").document(user2_id).get()
-        if not user1_doc.exists or not user2_doc.exists:
-            continue
-        user1_recitation = user1_doc.to_dict().get("last_recitation_time")
-        user2_recitation = user2_doc.to_dict().get("last_recitation_time")
-        if user1_recitation and user2_recitation:
-            time_diff = abs(user1_recitation - user2_recitation).total_seconds()
-            if time_diff <= 86400:  # 24 hours
-                # Increment streak
-                new_streak = streak["current_streak"] + 1
-                streaks_ref.document(streak_doc.id).update(
-                    {
-                        "current_streak": new_streak,
-                        "last_mutual_recitation": max(
-                            user1_recitation, user2_recitation
-                        ),
-                    }
-                )
-                print(
-                    f"Streak between '{user1_id}' and '{user2_id}' incremented to {new_streak}."
-                )
-            else:
-                # Reset streak
-                streaks_ref.document(streak_doc.id).update(
-                    {"current_streak": 0, "last_mutual_recitation": None}
-                )
-                print(f"Streak between '{user1_id}' and '{user2_id}' reset to 0.")
-        else:
-            # Reset streak if any user hasn't recited
-            streaks_ref.document(streak_doc.id).update(
-                {"current_streak": 0, "last_mutual_recitation": None}
-            )
-            print(
-                f"Streak between '{user1_id}' and '{user2_id}' reset to 0 due to missing recitation."
-            )
+    total, changed = recompute_streaks(db)
+    print(f"Recomputed {total} streaks; updated {changed}.")
 
 
 # Main Function to Populate Dummy Data
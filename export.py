@@ -0,0 +1,315 @@
+# export.py
+#
+# Streams Firestore collections into month-partitioned Parquet files with
+# bounded memory. Incremental runs only read documents changed since the
+# previous export, tracked in <output>/_export_state.json.
+#
+# Usage:
+#   python export.py --output exports                  # incremental
+#   python export.py --output exports --full users     # full re-export
+
+import argparse
+import datetime
+import json
+import os
+import uuid
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from google.cloud import firestore
+
+STATE_FILE = "_export_state.json"
+DEFAULT_PAGE_SIZE = 1000
+# Cursor fields are client timestamps taken before the write commits, so the
+# next incremental run re-reads this much before the previous run started.
+# Re-exported rows are de-duplicated when the snapshot is read.
+WATERMARK_MARGIN = datetime.timedelta(minutes=5)
+
+TIMESTAMP = pa.timestamp("us", tz="UTC")
+
+# Per-collection export configuration:
+#   cursor_field     field used for incremental runs ("since last export")
+#   partition_field  field whose month decides the output partition
+#   schema           exported fields (password hashes and emails stay out)
+EXPORTS = {
+    "users": {
+        "cursor_field": "updated_at",
+        "partition_field": "created_at",
+        "schema": pa.schema(
+            [
+                ("id", pa.string()),
+                ("username", pa.string()),
+                ("created_at", TIMESTAMP),
+                ("updated_at", TIMESTAMP),
+                ("last_recitation_time", TIMESTAMP),
+            ]
+        ),
+    },
+    "friendships": {
+        "cursor_field": "created_at",
+        "partition_field": "created_at",
+        "schema": pa.schema(
+            [
+                ("id", pa.string()),
+                ("user1_id", pa.string()),
+                ("user2_id", pa.string()),
+                ("created_at", TIMESTAMP),
+            ]
+        ),
+    },
+    "streaks": {
+        "cursor_field": "updated_at",
+        "partition_field": "updated_at",
+        "schema": pa.schema(
+            [
+                ("id", pa.string()),
+                ("user1_id", pa.string()),
+                ("user2_id", pa.string()),
+                ("current_streak", pa.int64()),
+                ("longest_streak", pa.int64()),
+                ("last_mutual_recitation", TIMESTAMP),
+                ("created_at", TIMESTAMP),
+                ("updated_at", TIMESTAMP),
+            ]
+        ),
+    },
+    "recitations": {
+        "cursor_field": "recited_at",
+        "partition_field": "recited_at",
+        "schema": pa.schema(
+            [
+                ("id", pa.string()),
+                ("user_id", pa.string()),
+                ("recited_at", TIMESTAMP),
+            ]
+        ),
+    },
+}
+
+
+# Initialize Firestore Client
+def init_firestore(credentials_path):
+    return firestore.Client.from_service_account_json(credentials_path)
+
+
+# Export State (watermarks of the last successful run per collection)
+def load_state(output_dir):
+    path = os.path.join(output_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(output_dir, state):
+    path = os.path.join(output_dir, STATE_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+# Stream documents page by page using query cursors
+def stream_pages(db, collection, fields, cursor_field, since, page_size):
+    query = db.collection(collection).select(fields)
+    if since is not None:
+        # Only documents written after the previous export
+        query = query.where(cursor_field, ">", since).order_by(cursor_field)
+    query = query.order_by("__name__").limit(page_size)
+    last_doc = None
+    while True:
+        page_query = query.start_after(last_doc) if last_doc is not None else query
+        page = list(page_query.stream())
+        if not page:
+            return
+        yield page
+        if len(page) < page_size:
+            return
+        last_doc = page[-1]
+
+
+def _coerce(value, field_type):
+    if value is None:
+        return None
+    if pa.types.is_timestamp(field_type):
+        if isinstance(value, datetime.datetime):
+            if value.tzinfo is None:
+                value = value.replace(tzinfo=datetime.timezone.utc)
+            return value
+        return None
+    if pa.types.is_integer(field_type):
+        return int(value)
+    return str(value)
+
+
+def _partition_month(value):
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%Y-%m")
+    return "unknown"
+
+
+# Writes one Parquet file per month partition, one row group per page.
+# Files are written under a hidden temporary name (readers skip names
+# starting with ".") and renamed into place by close(), so a snapshot never
+# contains a file that is still being written.
+class PartitionedWriter:
+    def __init__(self, output_dir, collection, schema, run_id):
+        self.output_dir = output_dir
+        self.collection = collection
+        self.schema = schema
+        self.run_id = run_id
+        self.writers = {}
+        self.paths = {}
+        self.rows_written = 0
+
+    def _writer(self, month):
+        if month not in self.writers:
+            partition_dir = os.path.join(
+                self.output_dir, self.collection, f"month={month}"
+            )
+            os.makedirs(partition_dir, exist_ok=True)
+            path = os.path.join(partition_dir, f"part-{self.run_id}.parquet")
+            self.paths[month] = path
+            self.writers[month] = pq.ParquetWriter(_temp_path(path), self.schema)
+        return self.writers[month]
+
+    def write_rows(self, rows_by_month):
+        for month, rows in rows_by_month.items():
+            table = pa.Table.from_pylist(rows, schema=self.schema)
+            self._writer(month).write_table(table)
+            self.rows_written += len(rows)
+
+    # Finish every file and move it into place
+    def close(self):
+        for month, writer in self.writers.items():
+            writer.close()
+            os.replace(_temp_path(self.paths[month]), self.paths[month])
+        self.writers = {}
+
+    # Discard the files of a failed run
+    def abort(self):
+        for month, writer in self.writers.items():
+            writer.close()
+            os.remove(_temp_path(self.paths[month]))
+            partition_dir = os.path.dirname(self.paths[month])
+            if not os.listdir(partition_dir):
+                os.rmdir(partition_dir)
+        self.writers = {}
+
+
+def _temp_path(path):
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.tmp")
+
+
+# Export one collection, returning the number of rows written
+def export_collection(db, collection, output_dir, since, run_id, page_size):
+    config = EXPORTS[collection]
+    schema = config["schema"]
+    fields = [name for name in schema.names if name != "id"]
+    writer = PartitionedWriter(output_dir, collection, schema, run_id)
+    try:
+        for page in stream_pages(
+            db, collection, fields, config["cursor_field"], since, page_size
+        ):
+            rows_by_month = {}
+            for doc in page:
+                data = doc.to_dict()
+                row = {"id": doc.id}
+                for field in schema:
+                    if field.name != "id":
+                        row[field.name] = _coerce(data.get(field.name), field.type)
+                month = _partition_month(
+                    row.get(config["partition_field"]) or row.get("created_at")
+                )
+                rows_by_month.setdefault(month, []).append(row)
+            writer.write_rows(rows_by_month)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+    return writer.rows_written
+
+
+# Remove part files of earlier runs once a full export has replaced them
+def remove_previous_parts(output_dir, collection, run_id):
+    collection_dir = os.path.join(output_dir, collection)
+    if not os.path.isdir(collection_dir):
+        return
+    current = f"part-{run_id}.parquet"
+    for partition in os.listdir(collection_dir):
+        partition_dir = os.path.join(collection_dir, partition)
+        if not os.path.isdir(partition_dir):
+            continue
+        for name in os.listdir(partition_dir):
+            if name != current:
+                os.remove(os.path.join(partition_dir, name))
+        if not os.listdir(partition_dir):
+            os.rmdir(partition_dir)
+
+
+# Run the export for the requested collections
+def run_export(db, output_dir, collections, full=False, page_size=DEFAULT_PAGE_SIZE):
+    os.makedirs(output_dir, exist_ok=True)
+    state = load_state(output_dir)
+    run_id = (
+        datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%S")
+        + f"-{uuid.uuid4().hex[:6]}"
+    )
+    for collection in collections:
+        # Writes landing during or shortly before the export are picked up
+        # again next run
+        started_at = datetime.datetime.now(datetime.timezone.utc)
+        since = None
+        if not full and collection in state:
+            since = datetime.datetime.fromisoformat(state[collection]["watermark"])
+        rows = export_collection(db, collection, output_dir, since, run_id, page_size)
+        if since is None:
+            # A full export is a complete copy, so older runs' files are stale
+            remove_previous_parts(output_dir, collection, run_id)
+        state[collection] = {
+            "watermark": (started_at - WATERMARK_MARGIN).isoformat(),
+            "exported_at": started_at.isoformat(),
+            "run_id": run_id,
+        }
+        save_state(output_dir, state)
+        mode = "full" if since is None else f"since {since.isoformat()}"
+        print(f"Exported {rows} {collection} documents ({mode}).")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Export Firestore collections to month-partitioned Parquet."
+    )
+    parser.add_argument(
+        "collections",
+        nargs="*",
+        help=f"Collections to export (default: all of {', '.join(EXPORTS)})",
+    )
+    parser.add_argument("--output", default="exports", help="Output directory")
+    parser.add_argument(
+        "--credentials",
+        default="firestore_credentials.json",
+        help="Service account JSON file",
+    )
+    parser.add_argument(
+        "--full", action="store_true", help="Ignore the saved state and export all"
+    )
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE)
+    args = parser.parse_args(argv)
+    unknown = set(args.collections) - set(EXPORTS)
+    if unknown:
+        parser.error(f"unknown collections: {', '.join(sorted(unknown))}")
+    args.collections = args.collections or list(EXPORTS)
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    run_export(
+        init_firestore(args.credentials),
+        args.output,
+        args.collections,
+        full=args.full,
+        page_size=args.page_size,
+    )
@@ -0,0 +1,405 @@
+# loadtest.py
+#
+# Drives main.py with Streamlit's AppTest at increasing concurrency against a
+# local Firestore emulator and reports throughput, rerun latency, memory per
+# session and the saturation point. AppTest swaps process-global state
+# (st.secrets, the Runtime singleton) on every run, so each concurrent worker
+# is its own process and runs its sessions one after another.
+#
+# Usage:
+#   gcloud emulators firestore start --host-port=localhost:8080
+#   python loadtest.py --emulator-host localhost:8080 --levels 1,2,4,8,16
+
+import argparse
+import base64
+import datetime
+import json
+import math
+import multiprocessing
+import os
+import secrets
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote
+
+import bcrypt
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+MAIN_SCRIPT = os.path.join(REPO_DIR, "main.py")
+
+# Must match the cookie manager configuration in main.py
+COOKIE_PREFIX = "quran_recitation_app/"
+COOKIE_COMPONENT_KEY = "CookieManager.sync_cookies"
+KEY_PARAMS_COOKIE = "EncryptedCookieManager.key_params"
+KEY_ITERATIONS = 390000
+
+LOADTEST_PASSWORD = "loadtest-password"
+BARRIER_TIMEOUT = 600  # Longest wait for every worker to finish warming up
+
+
+# Build a throwaway service account; the emulator accepts any credentials
+def fake_firestore_credentials(project_id):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption(),
+    ).decode()
+    return json.dumps(
+        {
+            "type": "service_account",
+            "project_id": project_id,
+            "private_key_id": uuid.uuid4().hex,
+            "private_key": pem,
+            "client_email": f"loadtest@{project_id}.iam.gserviceaccount.com",
+            "client_id": "0",
+            "token_uri": "https://oauth2.googleapis.com/token",
+        }
+    )
+
+
+# Encrypt an auth token the way EncryptedCookieManager does in the browser
+def encrypted_cookie_header(cookies_password, auth_token):
+    salt = os.urandom(16)
+    magic = os.urandom(16)
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(), length=32, salt=salt, iterations=KEY_ITERATIONS
+    )
+    key = base64.urlsafe_b64encode(kdf.derive(cookies_password.encode("utf-8")))
+    key_params = b":".join(
+        [base64.b64encode(salt), str(KEY_ITERATIONS).encode(), base64.b64encode(magic)]
+    ).decode()
+    encrypted_token = Fernet(key).encrypt(auth_token.encode("utf-8")).decode()
+    cookies = {
+        COOKIE_PREFIX + KEY_PARAMS_COOKIE: key_params,
+        COOKIE_PREFIX + "auth_token": encrypted_token,
+    }
+    return "; ".join(f"{quote(k)}={quote(v)}" for k, v in cookies.items())
+
+
+# Seed users and auth tokens. Sessions are paired (0-1, 2-3, ...) and the
+# first of each pair has a pending friend request from the second, so each
+# run creates one friendship per pair and no self-friendships.
+def seed_sessions(db, run_id, count, cookies_password):
+    password_hash = bcrypt.hashpw(
+        LOADTEST_PASSWORD.encode("utf-8"), bcrypt.gensalt()
+    ).decode()
+    now = time.time()
+    sessions = []
+    batch = db.batch()
+    pending_writes = 0
+    user_ids = [f"{run_id}_u{i}" for i in range(count)]
+    for i, user_id in enumerate(user_ids):
+        token = str(uuid.uuid4())
+        request_id = None
+        created_at = _utc(now)
+        batch.set(
+            db.collection("users").document(user_id),
+            {
+                "username": user_id,
+                "email": f"{user_id}@loadtest.local",
+                "password_hash": password_hash,
+                "created_at": created_at,
+                "updated_at": created_at,
+                "last_recitation_time": None,
+            },
+        )
+        batch.set(
+            db.collection("auth_tokens").document(),
+            {
+                "token": token,
+                "user_id": user_id,
+                "created_at": created_at,
+                "expires_at": _utc(now + 86400),
+            },
+        )
+        pending_writes += 2
+        if i % 2 == 0 and i + 1 < count:
+            request_id = f"{run_id}_r{i}"
+            batch.set(
+                db.collection("friend_requests").document(request_id),
+                {
+                    "from_user_id": user_ids[i + 1],
+                    "to_user_id": user_id,
+                    "status": "pending",
+                    "created_at": created_at,
+                },
+            )
+            pending_writes += 1
+        if pending_writes >= 450:
+            batch.commit()
+            batch = db.batch()
+            pending_writes = 0
+        sessions.append(
+            {
+                "user_id": user_id,
+                "request_id": request_id,
+                "cookie_header": encrypted_cookie_header(cookies_password, token),
+            }
+        )
+    if pending_writes:
+        batch.commit()
+    return sessions
+
+
+def _utc(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+
+
+# A single simulated browser session driving main.py
+class SessionRunner:
+    def __init__(self, session, app_secrets, timeout):
+        self.session = session
+        self.latencies = []
+        self.at = self.app(timeout)
+        for key, value in app_secrets.items():
+            self.at.secrets[key] = value
+        self.at.session_state[COOKIE_COMPONENT_KEY] = session["cookie_header"]
+
+    def app(self, timeout):
+        from streamlit.testing.v1 import AppTest
+
+        return AppTest.from_file(MAIN_SCRIPT, default_timeout=timeout)
+
+    def _timed(self, action):
+        start = time.perf_counter()
+        at = action()
+        self.latencies.append(time.perf_counter() - start)
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+        return at
+
+    def run_flow(self):
+        # Cookie login, which lands on the dashboard
+        at = self._timed(self.at.run)
+        if not at.session_state["logged_in"]:
+            raise RuntimeError(f"Cookie login failed for {self.session['user_id']}")
+        # Mark recitation
+        button = next(b for b in at.button if b.label == "Mark Recitation for Today")
+        at = self._timed(button.click().run)
+        # Open friend requests and accept the pending one, if any
+        at = self._timed(at.sidebar.radio[0].set_value("Friend Requests").run)
+        if self.session["request_id"]:
+            accept = at.button(key=f"accept_{self.session['request_id']}")
+            at = self._timed(accept.click().run)
+        # Back to the dashboard to view the new streak
+        self._timed(at.sidebar.radio[0].set_value("Dashboard").run)
+        return self.latencies
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    # Nearest-rank: the smallest value with at least pct% of samples at or below
+    ordered = sorted(values)
+    index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+# One concurrent worker: warm this process up with its own session, wait for
+# the other workers, then run the timed sessions sequentially
+def run_worker(runner, warmup, sessions, app_secrets, timeout, barrier):
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    errors = []
+    try:
+        runner(warmup, app_secrets, timeout).run_flow()
+    except Exception as e:
+        errors.append(f"warmup {warmup['user_id']}: {e}")
+    barrier.wait(BARRIER_TIMEOUT)
+    latencies = []
+    started = time.time()
+    for session in sessions:
+        try:
+            latencies.extend(runner(session, app_secrets, timeout).run_flow())
+        except Exception as e:
+            errors.append(f"{session['user_id']}: {e}")
+    return {
+        "latencies": latencies,
+        "errors": errors,
+        "started": started,
+        "finished": time.time(),
+    }
+
+
+# Run every seeded session once at the given concurrency, one worker process
+# per concurrent session. warmups holds one untimed session per worker.
+def run_level(sessions, warmups, app_secrets, concurrency, timeout, runner=None):
+    runner = runner or SessionRunner
+    context = multiprocessing.get_context("spawn")
+    with context.Manager() as manager, ProcessPoolExecutor(
+        max_workers=concurrency, mp_context=context
+    ) as pool:
+        barrier = manager.Barrier(concurrency)
+        futures = [
+            pool.submit(
+                run_worker,
+                runner,
+                warmups[worker],
+                sessions[worker::concurrency],
+                app_secrets,
+                timeout,
+                barrier,
+            )
+            for worker in range(concurrency)
+        ]
+        workers = [future.result() for future in futures]
+    latencies = [latency for worker in workers for latency in worker["latencies"]]
+    errors = [error for worker in workers for error in worker["errors"]]
+    # Measured from the moment every warm worker starts, so process start-up
+    # and first-run imports don't count against throughput
+    elapsed = max(w["finished"] for w in workers) - min(w["started"] for w in workers)
+    return {
+        "concurrency": concurrency,
+        "sessions": len(sessions),
+        "reruns": len(latencies),
+        "errors": errors,
+        "elapsed_s": elapsed,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+    }
+
+
+# Keep sessions alive after their flow and measure the retained memory. The
+# first session only warms up imports and module-level clients.
+def measure_session_memory(sessions, app_secrets, timeout):
+    warmup, sessions = sessions[0], sessions[1:]
+    SessionRunner(warmup, app_secrets, timeout).run_flow()
+    tracemalloc.start()
+    baseline = tracemalloc.take_snapshot()
+    runners = []
+    for session in sessions:
+        runner = SessionRunner(session, app_secrets, timeout)
+        runner.run_flow()
+        runners.append(runner)
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    retained = sum(stat.size_diff for stat in snapshot.compare_to(baseline, "filename"))
+    return retained / len(runners)
+
+
+# The first level whose throughput stops growing or whose p99 breaks budget
+def find_saturation(results, min_gain, p99_budget_ms):
+    best = None
+    for result in results:
+        if p99_budget_ms and result["p99_ms"] > p99_budget_ms:
+            return result, f"p99 {result['p99_ms']:.0f} ms > {p99_budget_ms:.0f} ms"
+        if best and result["throughput_rps"] < best["throughput_rps"] * (1 + min_gain):
+            return best, f"throughput gain < {min_gain:.0%} beyond this level"
+        best = result
+    return None, "not reached"
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Load-test main.py against a local Firestore emulator."
+    )
+    parser.add_argument(
+        "--emulator-host",
+        default=os.getenv("FIRESTORE_EMULATOR_HOST"),
+        help="Firestore emulator host:port (required, never runs against production)",
+    )
+    parser.add_argument("--project", default="demo-quran-recitation")
+    parser.add_argument(
+        "--levels", default="1,2,4,8,16,32", help="Comma-separated concurrency levels"
+    )
+    parser.add_argument(
+        "--sessions-per-worker",
+        type=int,
+        default=4,
+        help="Sessions run at each level per concurrent worker",
+    )
+    parser.add_argument("--timeout", type=float, default=60, help="Per-rerun timeout")
+    parser.add_argument("--memory-sessions", type=int, default=10)
+    parser.add_argument("--min-gain", type=float, default=0.1)
+    parser.add_argument("--p99-budget-ms", type=float, default=0)
+    parser.add_argument("--cache-url", help="Optional redis:// URL for the app cache")
+    parser.add_argument("--json", help="Write results to this file as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.emulator_host:
+        sys.exit("Set --emulator-host or FIRESTORE_EMULATOR_HOST to a local emulator.")
+    os.environ["FIRESTORE_EMULATOR_HOST"] = args.emulator_host
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+
+    from google.auth.credentials import AnonymousCredentials
+    from google.cloud import firestore
+
+    db = firestore.Client(project=args.project, credentials=AnonymousCredentials())
+    app_secrets = {
+        "cookies_password": secrets.token_urlsafe(16),
+        "firestore_credentials": fake_firestore_credentials(args.project),
+    }
+    if args.cache_url:
+        app_secrets["cache_url"] = args.cache_url
+    levels = [int(level) for level in args.levels.split(",")]
+
+    results = []
+    for concurrency in levels:
+        run_id = f"lt{uuid.uuid4().hex[:8]}"
+        count = concurrency * args.sessions_per_worker
+        sessions = seed_sessions(db, run_id, count, app_secrets["cookies_password"])
+        warmups = seed_sessions(
+            db, f"{run_id}w", concurrency, app_secrets["cookies_password"]
+        )
+        result = run_level(sessions, warmups, app_secrets, concurrency, args.timeout)
+        results.append(result)
+        print(
+            f"concurrency={concurrency:>4}  sessions={result['sessions']:>5}  "
+            f"reruns/s={result['throughput_rps']:>8.2f}  "
+            f"p50={result['p50_ms']:>8.1f} ms  p99={result['p99_ms']:>8.1f} ms  "
+            f"errors={len(result['errors'])}"
+        )
+        for error in result["errors"][:3]:
+            print(f"    {error}")
+
+    memory_per_session = None
+    if args.memory_sessions:
+        run_id = f"lt{uuid.uuid4().hex[:8]}"
+        sessions = seed_sessions(
+            db, run_id, args.memory_sessions + 1, app_secrets["cookies_password"]
+        )
+        memory_per_session = measure_session_memory(sessions, app_secrets, args.timeout)
+        print(f"\nMemory per session: {memory_per_session / 1024:.1f} KiB")
+
+    saturated, reason = find_saturation(results, args.min_gain, args.p99_budget_ms)
+    if saturated:
+        print(
+            f"Saturation point: concurrency {saturated['concurrency']} at "
+            f"{saturated['throughput_rps']:.2f} reruns/s ({reason})"
+        )
+    else:
+        print(f"Saturation point: {reason} up to concurrency {levels[-1]}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {
+                    "levels": results,
+                    "memory_per_session_bytes": memory_per_session,
+                    "saturation_concurrency": (
+                        saturated["concurrency"] if saturated else None
+                    ),
+                    "saturation_reason": reason,
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,6 @@
 import streamlit as st
 from streamlit_cookies_manager import EncryptedCookieManager
 from utils import (
-    db,  # Ensure 'db' is imported from utils.py
     register_user,
     login_user,
     send_friend_request,
@@ -15,26 +14,53 @@ from utils import (
     create_auth_token,
     verify_auth_token,
     delete_auth_token,
+    get_user,
+    create_circle,
+    invite_circle_member,
+    get_circle_invites,
+    respond_circle_invite,
+    leave_circle,
+    get_circles,
+    count_pending_requests,
+    get_dashboard_stats,
+    get_suggestions,
+    recitation_day_key,
+    has_recited_on,
 )
+from tracing import span, traced, start_rerun_trace
+from analytics import EXPORT_DIR, compute_analytics, snapshot_version
+import altair as alt
 import datetime
+import logging
 import time
 import os
+import uuid
 
 # 1. Set Streamlit Page Configuration
 st.set_page_config(page_title="Quran Recitation Tracker", layout="wide")
 
+# Trace this rerun when TRACE_FILE is set; ?profile=1 also profiles the session
+if "trace_session_id" not in st.session_state:
+    st.session_state["trace_session_id"] = uuid.uuid4().hex[:12]
+rerun_trace = start_rerun_trace(
+    st.session_state["trace_session_id"],
+    profile=st.query_params.get("profile") == "1",
+)
+
 # 2. Determine if the app is running in production
 # You can set an environment variable 'PRODUCTION' to 'True' in your deployment
 is_production = os.getenv("PRODUCTION", "False") == "True"
 
 # 2. Initialize Cookie Manager with a unique key from secrets
-cookies = EncryptedCookieManager(
-    prefix="quran_recitation_app/",
-    password=st.secrets["cookies_password"],  # Securely fetched from secrets
-)
+with span("cookies.init", "bootstrap"):
+    cookies = EncryptedCookieManager(
+        prefix="quran_recitation_app/",
+        password=st.secrets["cookies_password"],  # Securely fetched from secrets
+    )
 
 # 3. Ensure the cookie manager is initialized
 if not cookies.ready():
+    rerun_trace.finish()
     st.stop()
 
 # 4. Initialize Session State
@@ -44,18 +70,19 @@ if "user" not in st.session_state:
     st.session_state["user"] = None
 if "navigate_to" not in st.session_state:
     st.session_state["navigate_to"] = None  # Initialize navigation flag
+if "recited_on" not in st.session_state:
+    st.session_state["recited_on"] = None  # UTC day key of the last recitation
 
 # 5. Check for existing auth token in cookies
 if not st.session_state["logged_in"]:
-    auth_token = cookies.get("auth_token")
+    with span("cookies.decrypt", "bootstrap"):
+        auth_token = cookies.get("auth_token")
     if auth_token:
         user_id = verify_auth_token(auth_token)
         if user_id:
-            # Fetch user details from Firestore
-            user_doc = db.collection("users").document(user_id).get()
-            if user_doc.exists:
-                user = user_doc.to_dict()
-                user["id"] = user_doc.id
+            # Fetch user details (served from the shared cache when warm)
+            user = get_user(user_id)
+            if user:
                 st.session_state["logged_in"] = True
                 st.session_state["user"] = user
 
@@ -87,9 +114,23 @@ def main():
         elif choice == "Register":
             register()
     else:
-        st.sidebar.title(f"Hello, {st.session_state['user']['username']}!")
+        st.sidebar.title(f"Hello, {st.session_state['user'].username}!")
+        # Badge count from a single (cached) aggregation read; the badge is
+        # hidden rather than failing every page when the count is unavailable
+        try:
+            pending = count_pending_requests(st.session_state["user"].id)
+        except Exception as e:
+            logging.error(f"Error counting pending friend requests: {e}")
+            pending = 0
+        pages = ["Dashboard", "Friends", "Friend Requests", "Circles"]
+        if is_admin(st.session_state["user"]):
+            pages.append("Analytics")
         nav = st.sidebar.radio(
-            "Navigation", ["Dashboard", "Friends", "Friend Requests", "Logout"]
+            "Navigation",
+            pages + ["Logout"],
+            format_func=lambda page: (
+                f"{page} ({pending})" if page == "Friend Requests" and pending else page
+            ),
         )
         if nav == "Dashboard":
             dashboard()
@@ -97,11 +138,16 @@ def main():
             manage_friends()
         elif nav == "Friend Requests":
             manage_friend_requests()
+        elif nav == "Circles":
+            manage_circles()
+        elif nav == "Analytics":
+            analytics()
         elif nav == "Logout":
             logout()
 
 
 # 8. Registration Page
+@traced(category="page")
 def register():
     st.title("Register")
 
@@ -134,6 +180,7 @@ def register():
 
 
 # 9. Login Page
+@traced(category="page")
 def login():
     st.title("Login")
 
@@ -150,7 +197,7 @@ def login():
             if success:
                 user = result
                 # Generate and store auth token
-                token = create_auth_token(user["id"])
+                token = create_auth_token(user.id)
                 # Set the auth token in cookies
                 cookies["auth_token"] = token
                 cookies.save()
@@ -180,6 +227,7 @@ def login():
 
 
 # 10. Logout Function
+@traced(category="page")
 def logout():
     # Retrieve the auth token from cookies
     auth_token = cookies.get("auth_token")
@@ -191,6 +239,7 @@ def logout():
     # Update session state
     st.session_state["logged_in"] = False
     st.session_state["user"] = None
+    st.session_state["recited_on"] = None
 
     # Create a placeholder for the success message
     placeholder = st.empty()
@@ -207,34 +256,63 @@ def logout():
 
 
 # 11. Dashboard Page
+@traced(category="page")
 def dashboard():
     st.title("Dashboard")
-    user_id = st.session_state["user"]["id"]
+    user_id = st.session_state["user"].id
+    # Today's recitation state is kept in the session, so reruns after the
+    # first check don't read Firestore. If it can't be checked, the button is
+    # shown; marking twice is harmless.
+    today = recitation_day_key()
+    if st.session_state["recited_on"] != today:
+        try:
+            if has_recited_on(user_id, today):
+                st.session_state["recited_on"] = today
+        except Exception as e:
+            logging.error(f"Error checking today's recitation: {e}")
     # Recitation Button
-    if st.button("Mark Recitation for Today"):
+    if st.session_state["recited_on"] == today:
+        st.success("✅ You have already recited today.")
+    elif st.button("Mark Recitation for Today"):
         success, message = mark_recitation(user_id)
         if success:
+            st.session_state["recited_on"] = today
             st.success(message)
         else:
             st.warning(message)
+    # Display Totals (skipped if they can't be loaded or served from cache)
+    try:
+        stats = get_dashboard_stats(user_id)
+    except Exception as e:
+        logging.error(f"Error loading dashboard totals: {e}")
+        stats = None
+    if stats:
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Recitations this month", stats["recitations_this_month"])
+        col2.metric("Total recitations", stats["total_recitations"])
+        col3.metric("Friends reciting today", stats["friends_reciting_today"])
+        col4.metric("Streak days", stats["streak_days"])
+    else:
+        st.caption("Totals are unavailable right now.")
     # Display Streaks
     st.subheader("Your Streaks with Friends")
     streaks = get_streaks(user_id)
-    active_streaks = [s for s in streaks if s["current_streak"] > 0]
+    active_streaks = [s for s in streaks if s.current_streak > 0]
     if active_streaks:
         for streak in active_streaks:
-            st.write(f"**{streak['friend_username']}**: {streak['current_streak']} 🔥")
+            st.write(f"**{streak.friend_username}**: {streak.current_streak} 🔥")
     else:
         st.info("No active streaks. Start reciting to build streaks!")
 
 
 # 12. Friends Management Page
+@traced(category="page")
 def manage_friends():
     st.title("Your Friends")
-    friends = get_friends(st.session_state["user"]["id"])
+    friends = get_friends(st.session_state["user"].id)
     if friends:
         for friend in friends:
-            st.write(f"- {friend['username']}")
+            st.write(f"- {friend.username}")
     else:
         st.info("You have no friends yet. Send a friend request to get started!")
 
@@ -245,7 +323,7 @@ def manage_friends():
     if send_request:
         if friend_username:
             success, message = send_friend_request(
-                st.session_state["user"]["id"], friend_username
+                st.session_state["user"].id, friend_username
             )
             if success:
                 st.success(message)
@@ -254,19 +332,43 @@ def manage_friends():
         else:
             st.error("Please enter a username.")
 
+    st.subheader("People You May Know")
+    suggestions = get_suggestions(st.session_state["user"].id)
+    if suggestions:
+        for suggestion in suggestions:
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                mutual = "friend" if suggestion.mutual_friends == 1 else "friends"
+                st.write(
+                    f"**{suggestion.username}** · "
+                    f"{suggestion.mutual_friends} mutual {mutual}"
+                )
+            with col2:
+                if st.button("Add Friend", key=f"suggest_{suggestion.id}"):
+                    success, message = send_friend_request(
+                        st.session_state["user"].id, suggestion.username
+                    )
+                    if success:
+                        st.success(message)
+                    else:
+                        st.error(message)
+    else:
+        st.info("No suggestions yet. They appear as your friends add friends.")
+
 
 # 13. Friend Requests Management Page
+@traced(category="page")
 def manage_friend_requests():
     st.title("Friend Requests")
-    user_id = st.session_state["user"]["id"]
+    user_id = st.session_state["user"].id
     requests = get_friend_requests(user_id)
     if requests:
         for req in requests:
-            st.write(f"**From:** {req['from_username']}")
+            st.write(f"**From:** {req.from_username}")
             col1, col2 = st.columns(2)
             with col1:
-                if st.button("Accept", key=f"accept_{req['id']}"):
-                    success, message = respond_friend_request(req["id"], accept=True)
+                if st.button("Accept", key=f"accept_{req.id}"):
+                    success, message = respond_friend_request(req.id, accept=True)
                     if success:
                         st.success("Friend request accepted.")
                         # Optionally, you can refresh the page to update the list
@@ -274,8 +376,8 @@ def manage_friend_requests():
                     else:
                         st.error("Failed to accept friend request.")
             with col2:
-                if st.button("Reject", key=f"reject_{req['id']}"):
-                    success, message = respond_friend_request(req["id"], accept=False)
+                if st.button("Reject", key=f"reject_{req.id}"):
+                    success, message = respond_friend_request(req.id, accept=False)
                     if success:
                         st.warning("Friend request rejected.")
                         # Optionally, you can refresh the page to update the list
@@ -286,5 +388,185 @@ def manage_friend_requests():
         st.info("No pending friend requests.")
 
 
+# 14. Recitation Circles Page
+@traced(category="page")
+def manage_circles():
+    st.title("Recitation Circles")
+    user_id = st.session_state["user"].id
+    # Pending invites
+    invites = get_circle_invites(user_id)
+    if invites:
+        st.subheader("Circle Invites")
+        for invite in invites:
+            st.write(
+                f"**{invite['circle_name']}** (invited by {invite['from_username']})"
+            )
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("Join", key=f"join_{invite['id']}"):
+                    success, message = respond_circle_invite(
+                        invite["id"], user_id, accept=True
+                    )
+                    if success:
+                        st.success(message)
+                        st.rerun()
+                    else:
+                        st.error(message)
+            with col2:
+                if st.button("Decline", key=f"decline_{invite['id']}"):
+                    success, message = respond_circle_invite(
+                        invite["id"], user_id, accept=False
+                    )
+                    if success:
+                        st.warning(message)
+                        st.rerun()
+                    else:
+                        st.error(message)
+    circles = get_circles(user_id)
+    if circles:
+        for circle in circles:
+            st.subheader(f"{circle['name']}: {circle['current_streak']} 🔥")
+            st.caption(f"Longest group streak: {circle['longest_streak']}")
+            for member in circle["members"]:
+                status = "✅" if member["recited_today"] else "⏳"
+                st.write(f"{status} {member['username']}")
+            with st.form(f"invite_member_{circle['id']}"):
+                username = st.text_input(
+                    "Invite by username", key=f"circle_member_{circle['id']}"
+                )
+                invite_member = st.form_submit_button("Send Invite")
+            if invite_member:
+                if username:
+                    success, message = invite_circle_member(
+                        circle["id"], user_id, username
+                    )
+                    if success:
+                        st.success(message)
+                    else:
+                        st.error(message)
+                else:
+                    st.error("Please enter a username.")
+            if st.button("Leave Circle", key=f"leave_{circle['id']}"):
+                success, message = leave_circle(circle["id"], user_id)
+                if success:
+                    st.warning(message)
+                    st.rerun()
+                else:
+                    st.error(message)
+    else:
+        st.info("You are not in any circle yet. Create one to recite together!")
+
+    st.subheader("Create a Circle")
+    with st.form("create_circle_form"):
+        name = st.text_input("Circle Name")
+        create = st.form_submit_button("Create Circle")
+    if create:
+        if name:
+            success, message = create_circle(user_id, name)
+            if success:
+                st.success(message)
+                st.rerun()
+            else:
+                st.error(message)
+        else:
+            st.error("Please enter a circle name.")
+
+
+# 15. Analytics Page (admins listed in the 'admin_usernames' secret)
+def is_admin(user):
+    admins = st.secrets.get("admin_usernames", [])
+    # A TOML string instead of a list would match substrings of it
+    return isinstance(admins, (list, tuple)) and user.username in admins
+
+
+# Aggregates are shared by all sessions and recomputed only when export.py
+# writes a new snapshot (the version argument is part of the cache key)
+@st.cache_data(max_entries=2, show_spinner="Loading analytics snapshot...")
+def load_analytics(export_dir, version):
+    return compute_analytics(export_dir)
+
+
+@traced(category="page")
+def analytics():
+    st.title("Analytics")
+    if not is_admin(st.session_state["user"]):
+        st.error("You do not have access to this page.")
+        return
+    version = snapshot_version(EXPORT_DIR)
+    if version is None:
+        st.info("No export snapshot found. Run `python export.py` to create one.")
+        return
+    data = load_analytics(EXPORT_DIR, version)
+    snapshot_at = datetime.datetime.fromtimestamp(version, datetime.timezone.utc)
+    st.caption(f"Snapshot exported {snapshot_at:%Y-%m-%d %H:%M} UTC")
+    totals = data["totals"]
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Users", totals["users"])
+    col2.metric("Friendships", totals["friendships"])
+    col3.metric("Recitations", totals["recitations"])
+    col4.metric("Active streaks", totals["active_streaks"])
+
+    st.subheader("Daily Activity")
+    daily = data["daily"]
+    if daily.empty:
+        st.info("No recitations in the snapshot yet.")
+    else:
+        first = daily["date"].iloc[0].date()
+        last = daily["date"].iloc[-1].date()
+        start, end = first, last
+        if first < last:
+            start, end = st.slider(
+                "Date range",
+                min_value=first,
+                max_value=last,
+                value=(max(first, last - datetime.timedelta(days=90)), last),
+            )
+        window = daily[daily["date"].dt.date.between(start, end)]
+        chart = (
+            alt.Chart(window)
+            .transform_fold(["active_users", "recitations"], as_=["metric", "count"])
+            .mark_line()
+            .encode(
+                x=alt.X("date:T", title="Day"),
+                y=alt.Y("count:Q", title="Count"),
+                color=alt.Color("metric:N", title=None),
+                tooltip=["date:T", "metric:N", "count:Q"],
+            )
+        )
+        st.altair_chart(chart, use_container_width=True)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.subheader("Streak Lengths")
+        chart = (
+            alt.Chart(data["streaks"])
+            .transform_fold(["current", "longest"], as_=["streak", "pairs"])
+            .mark_bar()
+            .encode(
+                x=alt.X("streak_length:O", title="Days"),
+                y=alt.Y("pairs:Q", title="Friend pairs"),
+                xOffset="streak:N",
+                color=alt.Color("streak:N", title=None),
+                tooltip=["streak_length:O", "streak:N", "pairs:Q"],
+            )
+        )
+        st.altair_chart(chart, use_container_width=True)
+    with col2:
+        st.subheader("Friends per User")
+        chart = (
+            alt.Chart(data["friend_degrees"])
+            .mark_bar()
+            .encode(
+                x=alt.X("friends:O", title="Friends"),
+                y=alt.Y("users:Q", title="Users"),
+                tooltip=["friends:O", "users:Q"],
+            )
+        )
+        st.altair_chart(chart, use_container_width=True)
+
+
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        rerun_trace.finish()
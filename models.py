@@ -0,0 +1,165 @@
+# models.py
+#
+# Compact models for the documents the pages work with. Each model lists the
+# Firestore fields it needs in FIELDS so queries can select() only those,
+# and uses __slots__ so thousands of open sessions don't each carry a dict
+# per row. Password hashes and emails never make it into a model.
+
+import datetime
+
+from cache import serializable
+
+# Projection that returns only document names (existence checks)
+ID_ONLY = ["__name__"]
+
+
+def _utc(value):
+    # Firestore may hand back naive datetimes for older documents
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+# Streaks count UTC calendar days on which both friends recited. A streak is
+# current while its last mutual day is today or yesterday; the bulk engine in
+# streaks.py uses the same rule.
+def utc_day(moment):
+    return _utc(moment).astimezone(datetime.timezone.utc).date()
+
+
+def streak_is_current(last_mutual_recitation, now):
+    if last_mutual_recitation is None:
+        return False
+    return (utc_day(now) - utc_day(last_mutual_recitation)).days <= 1
+
+
+# Base class; to_dict/from_dict let models round-trip through the JSON cache
+class Model:
+    __slots__ = ()
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+# User
+@serializable
+class User(Model):
+    __slots__ = ("id", "username", "last_recitation_time", "circle_ids")
+    FIELDS = ["username", "last_recitation_time", "circle_ids"]
+
+    def __init__(self, id, username, last_recitation_time=None, circle_ids=()):
+        self.id = id
+        self.username = username
+        self.last_recitation_time = _utc(last_recitation_time)
+        self.circle_ids = tuple(circle_ids)
+
+    @classmethod
+    def from_doc(cls, doc):
+        data = doc.to_dict() or {}
+        return cls(
+            doc.id,
+            data.get("username", "Unknown"),
+            data.get("last_recitation_time"),
+            data.get("circle_ids") or (),
+        )
+
+    def __repr__(self):
+        return f"User(id={self.id!r}, username={self.username!r})"
+
+
+# Streak between the current user and one friend
+@serializable
+class Streak(Model):
+    __slots__ = (
+        "id",
+        "friend_id",
+        "friend_username",
+        "current_streak",
+        "longest_streak",
+        "last_mutual_recitation",
+    )
+    FIELDS = [
+        "user1_id",
+        "user2_id",
+        "current_streak",
+        "longest_streak",
+        "last_mutual_recitation",
+    ]
+
+    def __init__(
+        self,
+        id,
+        friend_id,
+        friend_username="Unknown",
+        current_streak=0,
+        longest_streak=0,
+        last_mutual_recitation=None,
+    ):
+        self.id = id
+        self.friend_id = friend_id
+        self.friend_username = friend_username
+        self.current_streak = current_streak
+        self.longest_streak = longest_streak
+        self.last_mutual_recitation = _utc(last_mutual_recitation)
+
+    @classmethod
+    def from_doc(cls, doc, user_id):
+        data = doc.to_dict() or {}
+        friend_id = (
+            data["user2_id"] if data["user1_id"] == user_id else data["user1_id"]
+        )
+        return cls(
+            doc.id,
+            friend_id,
+            current_streak=data.get("current_streak") or 0,
+            longest_streak=data.get("longest_streak") or 0,
+            last_mutual_recitation=data.get("last_mutual_recitation"),
+        )
+
+    def __repr__(self):
+        return (
+            f"Streak(friend_username={self.friend_username!r}, "
+            f"current_streak={self.current_streak})"
+        )
+
+
+# Pending friend request addressed to the current user
+@serializable
+class FriendRequest(Model):
+    __slots__ = ("id", "from_user_id", "from_username", "created_at")
+    FIELDS = ["from_user_id", "created_at"]
+
+    def __init__(self, id, from_user_id, from_username="Unknown", created_at=None):
+        self.id = id
+        self.from_user_id = from_user_id
+        self.from_username = from_username
+        self.created_at = _utc(created_at)
+
+    @classmethod
+    def from_doc(cls, doc):
+        data = doc.to_dict() or {}
+        return cls(doc.id, data["from_user_id"], created_at=data.get("created_at"))
+
+    def __repr__(self):
+        return f"FriendRequest(id={self.id!r}, from_username={self.from_username!r})"
+
+
+# "People you may know" entry
+@serializable
+class Suggestion(Model):
+    __slots__ = ("id", "username", "mutual_friends")
+
+    def __init__(self, id, username, mutual_friends):
+        self.id = id
+        self.username = username
+        self.mutual_friends = mutual_friends
+
+    def __repr__(self):
+        return (
+            f"Suggestion(username={self.username!r}, "
+            f"mutual_friends={self.mutual_friends})"
+        )
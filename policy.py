@@ -0,0 +1,228 @@
+# policy.py
+
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from google.api_core import exceptions as google_exceptions
+
+# Errors worth retrying; anything else (bad queries, permissions) fails fast
+TRANSIENT_ERRORS = (
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.TooManyRequests,
+    google_exceptions.Aborted,
+    google_exceptions.RetryError,
+    TimeoutError,
+)
+
+
+class CallTimeout(TimeoutError):
+    pass
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+# Deadline, retry and hedging settings for one kind of call
+class OperationPolicy:
+    def __init__(
+        self,
+        deadline=5.0,
+        retries=2,
+        idempotent=True,
+        hedge_percentile=95,
+        hedge_min_samples=20,
+        backoff_base=0.05,
+        backoff_cap=1.0,
+    ):
+        self.deadline = deadline
+        self.retries = retries
+        self.idempotent = idempotent
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+
+# Recent latencies of an operation, used to decide when to hedge
+class LatencyTracker:
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct, min_samples):
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(len(ordered) * pct / 100))
+        return ordered[index]
+
+
+# Opens after consecutive failures; lets one trial call through after a cooldown
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            # Half-open: allow a single trial call
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+# Runs backend calls under per-operation deadlines, retries, hedging and
+# circuit breakers. Calls receive the remaining time as their `timeout`
+# argument so the underlying RPC is cancelled at the same deadline. Attempts
+# run on the caller's thread; the shared pool only runs hedged reads, and only
+# on idle workers, so no attempt spends its deadline waiting in a queue.
+class CallPolicy:
+    def __init__(
+        self,
+        policies=None,
+        default=None,
+        max_workers=32,
+        failure_threshold=5,
+        reset_timeout=30.0,
+    ):
+        self.policies = policies or {}
+        self.default = default or OperationPolicy()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="backend-call"
+        )
+        self._idle_workers = threading.BoundedSemaphore(max_workers)
+        self._trackers = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def _state(self, operation):
+        with self._lock:
+            if operation not in self._trackers:
+                self._trackers[operation] = LatencyTracker()
+                self._breakers[operation] = CircuitBreaker(
+                    self.failure_threshold, self.reset_timeout
+                )
+            return self._trackers[operation], self._breakers[operation]
+
+    # `default` overrides the fallback policy for unregistered operations
+    def call(self, operation, fn, idempotent=None, default=None):
+        policy = self.policies.get(operation, default or self.default)
+        if idempotent is None:
+            idempotent = policy.idempotent
+        tracker, breaker = self._state(operation)
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {operation}")
+        deadline = time.monotonic() + policy.deadline
+        attempts = 1 + (policy.retries if idempotent else 0)
+        for attempt in range(attempts):
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise CallTimeout(f"{operation} exceeded {policy.deadline}s")
+                started = time.monotonic()
+                result = self._attempt(fn, remaining, policy, tracker, idempotent)
+                tracker.record(time.monotonic() - started)
+                breaker.record_success()
+                return result
+            except TRANSIENT_ERRORS as e:
+                remaining = deadline - time.monotonic()
+                if attempt == attempts - 1 or remaining <= 0:
+                    breaker.record_failure()
+                    raise
+                # Full jitter keeps retrying sessions from synchronizing
+                backoff = random.uniform(
+                    0, min(policy.backoff_cap, policy.backoff_base * 2**attempt)
+                )
+                logging.warning(
+                    f"{operation} failed ({e!r}); retry {attempt + 1} "
+                    f"in {backoff:.3f}s"
+                )
+                time.sleep(min(backoff, remaining))
+            except Exception:
+                breaker.record_success()  # Not a backend health problem
+                raise
+
+    # Start fn on an idle pool worker, or return None if every worker is busy
+    def _submit(self, fn, timeout):
+        if not self._idle_workers.acquire(blocking=False):
+            return None
+        future = self._executor.submit(fn, timeout)
+        future.add_done_callback(lambda _: self._idle_workers.release())
+        return future
+
+    def _attempt(self, fn, timeout, policy, tracker, idempotent):
+        hedge_after = None
+        if idempotent:
+            hedge_after = tracker.percentile(
+                policy.hedge_percentile, policy.hedge_min_samples
+            )
+        primary = None
+        if hedge_after is not None and hedge_after < timeout:
+            primary = self._submit(fn, timeout)
+        if primary is None:
+            # fn's own RPC timeout enforces the deadline
+            return fn(timeout)
+
+        # Send a duplicate read once the primary is slower than usual
+        started = time.monotonic()
+        done, _ = wait([primary], timeout=hedge_after)
+        if done:
+            return primary.result()
+        remaining = timeout - (time.monotonic() - started)
+        hedge = self._submit(fn, remaining)
+        pending = {primary} if hedge is None else {primary, hedge}
+        error = None
+        while pending:
+            remaining = timeout - (time.monotonic() - started)
+            if remaining <= 0:
+                break
+            done, pending = wait(
+                pending, timeout=remaining, return_when=FIRST_COMPLETED
+            )
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+                error = future.exception()
+        for future in pending:
+            future.cancel()
+        if error is not None:
+            raise error
+        raise CallTimeout(f"Call exceeded {timeout:.2f}s")
@@ -0,0 +1,274 @@
+# streaks.py
+#
+# Bulk streak recomputation. Loads the recitation history as columnar arrays,
+# computes current and longest streaks for every friend pair with vectorized
+# pandas/NumPy operations and writes back only the streaks that changed.
+#
+# A streak day is a UTC calendar day on which both friends recited; the
+# current streak is the run of consecutive mutual days ending today or
+# yesterday.
+#
+# Usage:
+#   python streaks.py --dry-run
+#   python streaks.py --credentials firestore_credentials.json
+
+import argparse
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from export import init_firestore, stream_pages
+
+# Firestore allows at most 500 writes per batch
+WRITE_BATCH_SIZE = 500
+PAGE_SIZE = 5000
+# Friend pairs processed per chunk, bounding the size of the day joins
+PAIR_CHUNK_SIZE = 200_000
+
+NS_PER_DAY = 86_400 * 10**9
+
+
+# Load recitations as (user_id, day, recited_at) with one row per user and day
+def load_recitations(db, page_size=PAGE_SIZE):
+    user_chunks = []
+    timestamp_chunks = []
+    for page in stream_pages(
+        db, "recitations", ["user_id", "recited_at"], None, None, page_size
+    ):
+        users = []
+        timestamps = []
+        for doc in page:
+            data = doc.to_dict()
+            if data.get("user_id") and data.get("recited_at"):
+                users.append(data["user_id"])
+                timestamps.append(data["recited_at"])
+        user_chunks.append(np.asarray(users, dtype=object))
+        timestamp_chunks.append(pd.to_datetime(timestamps, utc=True).as_unit("ns").asi8)
+    if not user_chunks:
+        return _recitation_frame(np.empty(0, dtype=object), np.empty(0, np.int64))
+    return _recitation_frame(
+        np.concatenate(user_chunks), np.concatenate(timestamp_chunks)
+    )
+
+
+def _recitation_frame(user_ids, recited_at_ns):
+    recitations = pd.DataFrame(
+        {
+            "user_id": pd.Categorical(user_ids),
+            "day": (recited_at_ns // NS_PER_DAY).astype(np.int32),
+            "recited_at": recited_at_ns,
+        }
+    )
+    # Keep the latest recitation per user and day
+    return (
+        recitations.groupby(["user_id", "day"], observed=True, sort=False)["recited_at"]
+        .max()
+        .reset_index()
+    )
+
+
+# Load existing streak documents as a DataFrame
+def load_streaks(db, page_size=PAGE_SIZE):
+    fields = [
+        "user1_id",
+        "user2_id",
+        "current_streak",
+        "longest_streak",
+        "last_mutual_recitation",
+    ]
+    rows = []
+    for page in stream_pages(db, "streaks", fields, None, None, page_size):
+        for doc in page:
+            data = doc.to_dict()
+            rows.append(
+                (
+                    doc.id,
+                    data.get("user1_id"),
+                    data.get("user2_id"),
+                    data.get("current_streak") or 0,
+                    data.get("longest_streak") or 0,
+                    data.get("last_mutual_recitation"),
+                )
+            )
+    streaks = pd.DataFrame(rows, columns=["id", *fields])
+    streaks["last_mutual_recitation"] = pd.to_datetime(
+        streaks["last_mutual_recitation"], utc=True
+    )
+    return streaks
+
+
+# Compute streaks for every pair; returns id, current, longest and last mutual
+def compute_streaks(recitations, pairs, today=None):
+    if today is None:
+        today = datetime.datetime.now(datetime.timezone.utc).date()
+    today_day = (today - datetime.date(1970, 1, 1)).days
+    # Align user categories so the joins compare codes, not strings
+    users = pd.Index(
+        pd.concat(
+            [
+                pairs["user1_id"],
+                pairs["user2_id"],
+                recitations["user_id"].astype(object),
+            ]
+        ).unique()
+    )
+    recitation_codes = pd.DataFrame(
+        {
+            "user": users.get_indexer(recitations["user_id"].astype(object)),
+            "day": recitations["day"].to_numpy(),
+            "recited_at": recitations["recited_at"].to_numpy(),
+        }
+    )
+    results = []
+    for start in range(0, len(pairs), PAIR_CHUNK_SIZE):
+        chunk = pairs.iloc[start : start + PAIR_CHUNK_SIZE]
+        results.append(_compute_chunk(chunk, users, recitation_codes, today_day))
+    if not results:
+        return _empty_result()
+    return pd.concat(results, ignore_index=True)
+
+
+def _compute_chunk(pairs, users, recitation_codes, today_day):
+    pair_codes = pd.DataFrame(
+        {
+            "pair": np.arange(len(pairs)),
+            "user1": users.get_indexer(pairs["user1_id"]),
+            "user2": users.get_indexer(pairs["user2_id"]),
+        }
+    )
+    # Days on which both users of a pair recited
+    first = pair_codes.merge(recitation_codes, left_on="user1", right_on="user")[
+        ["pair", "user2", "day", "recited_at"]
+    ]
+    mutual = first.merge(
+        recitation_codes,
+        left_on=["user2", "day"],
+        right_on=["user", "day"],
+        suffixes=("_1", "_2"),
+    )
+    mutual = mutual.sort_values(["pair", "day"], kind="stable")
+    pair = mutual["pair"].to_numpy()
+    day = mutual["day"].to_numpy()
+    recited_at = np.maximum(
+        mutual["recited_at_1"].to_numpy(), mutual["recited_at_2"].to_numpy()
+    )
+
+    current = np.zeros(len(pairs), dtype=np.int64)
+    longest = np.zeros(len(pairs), dtype=np.int64)
+    last_mutual = np.full(len(pairs), np.iinfo(np.int64).min, dtype=np.int64)
+    if len(pair):
+        # A run starts at each new pair or after a gap of more than one day
+        new_run = np.ones(len(pair), dtype=bool)
+        new_run[1:] = (pair[1:] != pair[:-1]) | (np.diff(day) != 1)
+        run_ids = np.cumsum(new_run) - 1
+        run_lengths = np.bincount(run_ids)
+        row_run_length = run_lengths[run_ids]
+        np.maximum.at(longest, pair, row_run_length)
+        # The last mutual day of each pair decides the current streak
+        is_last = np.ones(len(pair), dtype=bool)
+        is_last[:-1] = pair[1:] != pair[:-1]
+        last_pairs = pair[is_last]
+        is_active = day[is_last] >= today_day - 1
+        current[last_pairs] = np.where(is_active, row_run_length[is_last], 0)
+        last_mutual[last_pairs] = recited_at[is_last]
+
+    return pd.DataFrame(
+        {
+            "id": pairs["id"].to_numpy(),
+            "current_streak": current,
+            "longest_streak": longest,
+            "last_mutual_recitation": pd.to_datetime(
+                np.where(
+                    last_mutual == np.iinfo(np.int64).min,
+                    np.datetime64("NaT"),
+                    last_mutual.astype("datetime64[ns]"),
+                ),
+                utc=True,
+            ),
+        }
+    )
+
+
+def _empty_result():
+    return pd.DataFrame(
+        {
+            "id": pd.Series(dtype=object),
+            "current_streak": pd.Series(dtype=np.int64),
+            "longest_streak": pd.Series(dtype=np.int64),
+            "last_mutual_recitation": pd.Series(dtype="datetime64[ns, UTC]"),
+        }
+    )
+
+
+# Rows whose computed values differ from what is stored
+def changed_streaks(streaks, computed):
+    merged = streaks.merge(computed, on="id", suffixes=("_old", ""))
+    old_last = merged["last_mutual_recitation_old"]
+    new_last = merged["last_mutual_recitation"]
+    last_changed = (old_last != new_last) & ~(old_last.isna() & new_last.isna())
+    changed = (
+        (merged["current_streak_old"] != merged["current_streak"])
+        | (merged["longest_streak_old"] != merged["longest_streak"])
+        | last_changed
+    )
+    return merged.loc[changed, computed.columns]
+
+
+# Write changed streaks back in batches
+def write_streaks(db, changes, batch_size=WRITE_BATCH_SIZE):
+    streaks_ref = db.collection("streaks")
+    now = datetime.datetime.now(datetime.timezone.utc)
+    batch = db.batch()
+    pending = 0
+    for row in changes.itertuples(index=False):
+        last_mutual = row.last_mutual_recitation
+        batch.update(
+            streaks_ref.document(row.id),
+            {
+                "current_streak": int(row.current_streak),
+                "longest_streak": int(row.longest_streak),
+                "last_mutual_recitation": (
+                    None if pd.isna(last_mutual) else last_mutual.to_pydatetime()
+                ),
+                "updated_at": now,
+            },
+        )
+        pending += 1
+        if pending == batch_size:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+
+
+# Recompute all streaks and write back the changed ones
+def recompute_streaks(db, dry_run=False, today=None):
+    recitations = load_recitations(db)
+    streaks = load_streaks(db)
+    computed = compute_streaks(recitations, streaks, today=today)
+    changes = changed_streaks(streaks, computed)
+    if not dry_run:
+        write_streaks(db, changes)
+    return len(streaks), len(changes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Recompute current and longest streaks for all friend pairs."
+    )
+    parser.add_argument(
+        "--credentials",
+        default="firestore_credentials.json",
+        help="Service account JSON file",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Compute changes without writing"
+    )
+    args = parser.parse_args()
+    total, changed = recompute_streaks(
+        init_firestore(args.credentials), dry_run=args.dry_run
+    )
+    action = "would change" if args.dry_run else "updated"
+    print(f"Recomputed {total} streaks; {action} {changed}.")
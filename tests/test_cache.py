@@ -0,0 +1,104 @@
+import datetime
+import pickle
+import time
+
+import pytest
+
+from cache import MISSING, InProcessCache, RedisCache, dumps, loads, memoize
+from models import Streak, User
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@pytest.fixture
+def fakeredis():
+    return pytest.importorskip("fakeredis")
+
+
+@pytest.fixture
+def server(fakeredis):
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def replicas(fakeredis, server):
+    caches = [
+        RedisCache(client=fakeredis.FakeRedis(server=server), near_cache_ttl=30)
+        for _ in range(2)
+    ]
+    yield caches
+    for cache in caches:
+        cache.close()
+
+
+def test_get_set_round_trips_models(replicas):
+    first, second = replicas
+    recited_at = datetime.datetime(2026, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)
+    user = User("u1", "amina", recited_at, ("c1", "c2"))
+    first.set("user:u1", user)
+    cached = second.get("user:u1")
+    assert isinstance(cached, User)
+    assert cached.to_dict() == user.to_dict()
+    streaks = [Streak("s1", "u2", "bilal", 3, 5, recited_at)]
+    first.set("streaks:u1", (time.time() + 60, streaks))
+    _, cached = second.get("streaks:u1")
+    assert cached[0].to_dict() == streaks[0].to_dict()
+
+
+def test_missing_keys(replicas):
+    first, second = replicas
+    assert first.get("nope") is MISSING
+    first.set("none", None)
+    assert second.get("none") is None
+
+
+def test_invalidate_drops_other_replicas_near_cache(replicas):
+    first, second = replicas
+    first.set("stats:u1", {"total": 1})
+    assert second.get("stats:u1") == {"total": 1}
+    # Written behind the near-cache's back: the replica still serves its copy
+    first.client.set("stats:u1", dumps({"total": 2}))
+    assert second.get("stats:u1") == {"total": 1}
+    first.invalidate("stats:u1")
+    assert wait_for(lambda: second.near_cache.get("stats:u1") is MISSING)
+    assert second.get("stats:u1") is MISSING
+
+
+def test_pickled_entries_are_not_loaded(replicas):
+    first, _ = replicas
+    first.client.set("user:u1", pickle.dumps({"username": "x"}))
+    assert first.get("user:u1") is MISSING
+
+
+def test_unregistered_types_are_not_cached(replicas):
+    first, _ = replicas
+    first.set("obj", object())
+    assert first.client.get("obj") is None
+
+
+def test_loads_rejects_unknown_types():
+    with pytest.raises(ValueError):
+        loads('{"__type__": "Popen", "fields": {}}')
+
+
+def test_memoize_serves_stale_value_on_error():
+    backend = InProcessCache(default_ttl=0)
+    calls = []
+
+    @memoize(backend, "value", stale_ttl=60)
+    def value(key):
+        calls.append(key)
+        if len(calls) > 1:
+            raise TimeoutError
+        return 42
+
+    assert value("a") == 42
+    assert value("a") == 42
+    assert calls == ["a", "a"]
@@ -0,0 +1,58 @@
+from loadtest import SessionRunner, percentile, run_level
+
+# Reads a secret on every rerun, as main.py does for the cookie password. When
+# AppTest runs overlap in one process they swap st.secrets under each other.
+SCRIPT = """
+import time
+
+import streamlit as st
+
+st.session_state["runs"] = st.session_state.get("runs", 0) + 1
+time.sleep(0.05)
+st.text(f"{st.secrets['cookies_password']}:{st.session_state['runs']}")
+"""
+
+
+class SecretsRunner(SessionRunner):
+    def app(self, timeout):
+        from streamlit.testing.v1 import AppTest
+
+        return AppTest.from_string(SCRIPT, default_timeout=timeout)
+
+    def run_flow(self):
+        for run in range(1, 4):
+            at = self._timed(self.at.run)
+            expected = f"{self.at.secrets['cookies_password']}:{run}"
+            if at.text[0].value != expected:
+                raise RuntimeError(f"Expected {expected!r}, got {at.text[0].value!r}")
+        return self.latencies
+
+
+def sessions(prefix, count):
+    return [
+        {"user_id": f"{prefix}{i}", "request_id": None, "cookie_header": ""}
+        for i in range(count)
+    ]
+
+
+def test_concurrent_workers_run_without_errors():
+    result = run_level(
+        sessions("u", 8),
+        sessions("w", 4),
+        {"cookies_password": "secret"},
+        concurrency=4,
+        timeout=30,
+        runner=SecretsRunner,
+    )
+    assert result["errors"] == []
+    assert result["sessions"] == 8
+    assert result["reruns"] == 24
+    assert result["throughput_rps"] > 0
+
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([5], 99) == 5
+    assert percentile([], 99) == 0.0
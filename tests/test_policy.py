@@ -0,0 +1,147 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from policy import CallPolicy, CircuitOpenError, OperationPolicy
+
+
+def no_backoff(**kwargs):
+    return OperationPolicy(backoff_base=0, **kwargs)
+
+
+# A backend call that honours its timeout like a Firestore RPC does
+def slow_call(seconds):
+    def call(timeout):
+        if seconds > timeout:
+            time.sleep(timeout)
+            raise google_exceptions.DeadlineExceeded("deadline")
+        time.sleep(seconds)
+        return "ok"
+
+    return call
+
+
+def failing(*errors):
+    calls = []
+
+    def call(timeout):
+        calls.append(timeout)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return "ok"
+
+    return call, calls
+
+
+def test_deadline_covers_all_attempts():
+    policy = CallPolicy(default=no_backoff(deadline=0.3, retries=2))
+    started = time.monotonic()
+    with pytest.raises(google_exceptions.DeadlineExceeded):
+        policy.call("slow", slow_call(1.0))
+    # The first attempt used the whole deadline, so nothing was retried
+    assert time.monotonic() - started < 0.6
+
+
+def test_transient_errors_are_retried_for_idempotent_calls():
+    policy = CallPolicy(default=no_backoff(retries=2))
+    call, calls = failing(
+        google_exceptions.ServiceUnavailable("down"),
+        google_exceptions.Aborted("contention"),
+    )
+    assert policy.call("read", call) == "ok"
+    assert len(calls) == 3
+    # Each retry gets only what is left of the same deadline
+    assert calls[0] >= calls[1] >= calls[2]
+
+
+def test_writes_and_permanent_errors_are_not_retried():
+    policy = CallPolicy(default=no_backoff(retries=2))
+    call, calls = failing(google_exceptions.ServiceUnavailable("down"))
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        policy.call("write", call, idempotent=False)
+    assert len(calls) == 1
+    call, calls = failing(google_exceptions.PermissionDenied("no"))
+    with pytest.raises(google_exceptions.PermissionDenied):
+        policy.call("read", call)
+    assert len(calls) == 1
+
+
+def test_slow_read_is_hedged():
+    policy = CallPolicy(default=no_backoff(deadline=3.0, hedge_min_samples=5))
+    for _ in range(5):
+        policy.call("read", slow_call(0.01))
+    calls = []
+    lock = threading.Lock()
+
+    def call(timeout):
+        with lock:
+            calls.append(timeout)
+            first = len(calls) == 1
+        return slow_call(2.0 if first else 0.01)(timeout)
+
+    started = time.monotonic()
+    assert policy.call("read", call) == "ok"
+    assert len(calls) == 2
+    assert time.monotonic() - started < 1.0
+
+
+def test_queued_calls_do_not_time_out():
+    # More concurrent callers than pool workers against a healthy backend
+    policy = CallPolicy(
+        default=no_backoff(deadline=1.0, hedge_min_samples=1), max_workers=4
+    )
+    policy.call("read", slow_call(0.4))
+    with ThreadPoolExecutor(max_workers=16) as callers:
+        futures = [
+            callers.submit(policy.call, "read", slow_call(0.4)) for _ in range(16)
+        ]
+        assert [future.result() for future in futures] == ["ok"] * 16
+    _, breaker = policy._state("read")
+    assert breaker.allow()
+
+
+def test_breaker_opens_then_lets_one_trial_through():
+    policy = CallPolicy(
+        default=no_backoff(retries=0), failure_threshold=2, reset_timeout=0.2
+    )
+    for _ in range(2):
+        call, _ = failing(google_exceptions.ServiceUnavailable("down"))
+        with pytest.raises(google_exceptions.ServiceUnavailable):
+            policy.call("read", call)
+    call, calls = failing()
+    with pytest.raises(CircuitOpenError):
+        policy.call("read", call)
+    assert calls == []
+
+    time.sleep(0.25)
+    release = threading.Event()
+    trial = ThreadPoolExecutor(max_workers=1).submit(
+        policy.call, "read", lambda timeout: release.wait(timeout) and "trial"
+    )
+    time.sleep(0.05)
+    # Half-open: a second call is rejected while the trial is in flight
+    with pytest.raises(CircuitOpenError):
+        policy.call("read", call)
+    release.set()
+    assert trial.result() == "trial"
+    assert policy.call("read", call) == "ok"
+
+
+def test_failed_trial_reopens_breaker():
+    policy = CallPolicy(
+        default=no_backoff(retries=0), failure_threshold=1, reset_timeout=0.2
+    )
+    call, _ = failing(
+        google_exceptions.ServiceUnavailable("down"),
+        google_exceptions.ServiceUnavailable("still down"),
+    )
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        policy.call("read", call)
+    time.sleep(0.25)
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        policy.call("read", call)
+    with pytest.raises(CircuitOpenError):
+        policy.call("read", call)
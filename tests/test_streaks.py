@@ -0,0 +1,101 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from models import streak_is_current
+from streaks import _recitation_frame, changed_streaks, compute_streaks
+
+TODAY = datetime.date(2026, 3, 10)
+
+
+def recitations(history):
+    # history: {user_id: [days before TODAY, ...]}, reciting at 08:00 UTC
+    user_ids = []
+    timestamps = []
+    for user_id, days_ago in history.items():
+        for days in days_ago:
+            moment = datetime.datetime.combine(
+                TODAY - datetime.timedelta(days=days),
+                datetime.time(8),
+                datetime.timezone.utc,
+            )
+            user_ids.append(user_id)
+            timestamps.append(pd.Timestamp(moment).value)
+    return _recitation_frame(
+        np.asarray(user_ids, dtype=object), np.asarray(timestamps, dtype=np.int64)
+    )
+
+
+def pairs(*rows):
+    return pd.DataFrame(
+        {
+            "id": [row[0] for row in rows],
+            "user1_id": [row[1] for row in rows],
+            "user2_id": [row[2] for row in rows],
+            "current_streak": [row[3] for row in rows],
+            "longest_streak": [row[4] for row in rows],
+            "last_mutual_recitation": pd.to_datetime(
+                [row[5] for row in rows], utc=True
+            ),
+        }
+    )
+
+
+def by_id(computed):
+    return computed.set_index("id")
+
+
+def test_current_and_longest_runs():
+    history = recitations(
+        {
+            # Mutual with b on days 6-4 (a run of 3), then 1-0 (current run of 2)
+            "a": [6, 5, 4, 1, 0, 0],
+            "b": [6, 5, 4, 3, 1, 0],
+            # Mutual with a on day 4 only
+            "c": [4, 2],
+            "d": [],
+        }
+    )
+    result = by_id(
+        compute_streaks(
+            history,
+            pairs(
+                ("ab", "a", "b", 0, 0, None),
+                ("ac", "a", "c", 0, 0, None),
+                ("ad", "a", "d", 0, 0, None),
+            ),
+            today=TODAY,
+        )
+    )
+    assert result.loc["ab", ["current_streak", "longest_streak"]].tolist() == [2, 3]
+    assert result.loc["ab", "last_mutual_recitation"].date() == TODAY
+    # The last mutual day is long gone, so only the longest run remains
+    assert result.loc["ac", ["current_streak", "longest_streak"]].tolist() == [0, 1]
+    assert result.loc["ad", ["current_streak", "longest_streak"]].tolist() == [0, 0]
+    assert pd.isna(result.loc["ad", "last_mutual_recitation"])
+
+
+def test_run_ending_yesterday_is_still_current():
+    history = recitations({"a": [3, 2, 1], "b": [3, 2, 1]})
+    result = by_id(
+        compute_streaks(history, pairs(("ab", "a", "b", 0, 0, None)), today=TODAY)
+    )
+    assert result.loc["ab", "current_streak"] == 3
+    last_mutual = result.loc["ab", "last_mutual_recitation"].to_pydatetime()
+    now = datetime.datetime.combine(TODAY, datetime.time(23), datetime.timezone.utc)
+    # The live path agrees that a run ending yesterday is current
+    assert streak_is_current(last_mutual, now)
+    assert not streak_is_current(last_mutual, now + datetime.timedelta(days=1))
+
+
+def test_changed_streaks_returns_only_differences():
+    history = recitations({"a": [1, 0], "b": [1, 0], "c": [0]})
+    stored = pairs(
+        ("ab", "a", "b", 2, 2, "2026-03-10 08:00:00+00:00"),
+        ("ac", "a", "c", 5, 5, "2026-03-10 08:00:00+00:00"),
+    )
+    computed = compute_streaks(history, stored, today=TODAY)
+    changes = changed_streaks(stored, computed)
+    assert changes["id"].tolist() == ["ac"]
+    assert changes.iloc[0][["current_streak", "longest_streak"]].tolist() == [1, 1]
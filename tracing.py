@@ -0,0 +1,174 @@
+# tracing.py
+#
+# Lightweight span timing written as Chrome trace events (open the file in
+# chrome://tracing or https://ui.perfetto.dev). Enable it by setting the
+# TRACE_FILE environment variable; spans cost a single check when it's unset.
+#
+# With tracing enabled, adding ?profile=1 to the URL also runs a sampling
+# profiler for that session's reruns and writes folded stacks (for
+# flamegraph.pl or speedscope) to PROFILE_DIR.
+
+import collections
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+TRACE_FILE = os.getenv("TRACE_FILE")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL = 0.005  # Seconds between profiler samples
+
+
+# Appends events to the trace file in Chrome's JSON array format. The array
+# is left unterminated, which the trace viewers accept.
+class TraceWriter:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        # Anchor perf_counter to wall-clock time so files from runs line up
+        self._origin_us = time.time_ns() // 1000 - time.perf_counter_ns() // 1000
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            with open(path, "w") as f:
+                f.write("[\n")
+
+    def now_us(self):
+        return self._origin_us + time.perf_counter_ns() // 1000
+
+    def write(self, events):
+        lines = "".join(json.dumps(event, default=str) + ",\n" for event in events)
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(lines)
+
+    def complete_event(self, name, category, start_us, end_us, args):
+        return {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": start_us,
+            "dur": end_us - start_us,
+            "pid": self._pid,
+            "tid": threading.get_ident(),
+            "args": args,
+        }
+
+
+_writer = TraceWriter(TRACE_FILE) if TRACE_FILE else None
+_local = threading.local()
+
+
+def enabled():
+    return _writer is not None
+
+
+# Time a block; events are buffered per thread and flushed when the
+# outermost span on that thread ends
+@contextmanager
+def span(name, category="app", **args):
+    if _writer is None:
+        yield
+        return
+    depth = getattr(_local, "depth", 0)
+    if depth == 0:
+        _local.events = []
+    _local.depth = depth + 1
+    start_us = _writer.now_us()
+    try:
+        yield
+    finally:
+        end_us = _writer.now_us()
+        _local.depth = depth
+        _local.events.append(
+            _writer.complete_event(name, category, start_us, end_us, args)
+        )
+        if depth == 0:
+            _writer.write(_local.events)
+            _local.events = []
+
+
+# Decorator form of span, named after the function by default
+def traced(name=None, category="app"):
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _writer is None:
+                return func(*args, **kwargs)
+            with span(span_name, category):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# Samples one thread's stack at a fixed interval
+class SamplingProfiler:
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="sampling-profiler", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                filename = os.path.basename(code.co_filename)
+                stack.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self, path):
+        self._stop.set()
+        self._thread.join()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            for stack, count in self.samples.items():
+                f.write(f"{stack} {count}\n")
+
+
+# Span covering one script rerun, optionally profiled
+class RerunTrace:
+    def __init__(self, session_id, profile=False):
+        self.session_id = session_id
+        # Drop state left by a previous rerun on this thread that never finished
+        _local.depth = 0
+        self._span = span("rerun", "streamlit", session_id=session_id)
+        self._span.__enter__()
+        self._profiler = None
+        if profile:
+            self._profiler = SamplingProfiler(threading.get_ident())
+            self._profiler.start()
+        self._finished = False
+
+    def finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        if self._profiler is not None:
+            path = os.path.join(
+                PROFILE_DIR, f"{self.session_id}-{time.time_ns()}.folded"
+            )
+            self._profiler.stop(path)
+        self._span.__exit__(None, None, None)
+
+
+def start_rerun_trace(session_id, profile=False):
+    # Profiling is only available when tracing is switched on for the server
+    return RerunTrace(session_id, profile=profile and enabled())
@@ -1,5 +1,6 @@
 # utils.py
 
+import argparse
 import bcrypt
 from google.cloud import firestore
 import datetime
@@ -8,6 +9,21 @@ import json
 from google.oauth2 import service_account
 import uuid  # For generating unique tokens
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from google.api_core import exceptions as google_exceptions
+from cache import create_cache, memoize
+from policy import CallPolicy, OperationPolicy
+from tracing import span, traced
+from models import (
+    ID_ONLY,
+    FriendRequest,
+    Streak,
+    Suggestion,
+    User,
+    streak_is_current,
+    utc_day,
+)
 
 
 # Initialize Firestore Client
@@ -30,126 +46,262 @@ def init_firestore():
 db = init_firestore()
 
 
+# Initialize Cache Backend
+# Set 'cache_url' in secrets (or CACHE_URL in the environment) to a redis:// URL
+# to share the cache between server processes; otherwise it stays in-process.
+def init_cache():
+    cache_url = os.getenv("CACHE_URL") or st.secrets.get("cache_url")
+    return create_cache(cache_url)
+
+
+cache = init_cache()
+
+
+# Firestore Call Policy
+# Every Firestore call runs under a deadline. Reads are retried with jitter
+# and hedged when slower than their recent p95; writes are never retried.
+# Repeated failures open a per-operation circuit breaker, and the memoized
+# reads below then fall back to their last cached value.
+READ_POLICY = OperationPolicy(deadline=5.0, retries=2)
+WRITE_POLICY = OperationPolicy(deadline=10.0, retries=0, idempotent=False)
+STALE_TTL = 86400  # How long cached reads may be served while degraded
+
+policy = CallPolicy(
+    {
+        "auth_tokens.query": OperationPolicy(deadline=3.0, retries=2),
+        "users.get": OperationPolicy(deadline=3.0, retries=2),
+    },
+    default=READ_POLICY,
+)
+
+
+def stream_query(operation, query):
+    with span(operation, "firestore"):
+        return policy.call(
+            operation, lambda timeout: list(query.stream(retry=None, timeout=timeout))
+        )
+
+
+# Run an aggregation query and return its single value
+def aggregate(operation, aggregation_query):
+    with span(operation, "firestore"):
+        results = policy.call(
+            operation,
+            lambda timeout: aggregation_query.get(retry=None, timeout=timeout),
+        )
+    value = results[0][0].value if results and results[0] else 0
+    return int(value or 0)
+
+
+def get_document(operation, doc_ref, field_paths=None):
+    with span(operation, "firestore"):
+        return policy.call(
+            operation,
+            lambda timeout: doc_ref.get(
+                field_paths=field_paths, retry=None, timeout=timeout
+            ),
+        )
+
+
+def get_documents(operation, doc_refs, field_paths=None):
+    with span(operation, "firestore"):
+        return policy.call(
+            operation,
+            lambda timeout: list(
+                db.get_all(
+                    doc_refs, field_paths=field_paths, retry=None, timeout=timeout
+                )
+            ),
+        )
+
+
+def write(operation, method, *args):
+    with span(operation, "firestore"):
+        return policy.call(
+            operation,
+            lambda timeout: method(*args, retry=None, timeout=timeout),
+            default=WRITE_POLICY,
+        )
+
+
+# Background Jobs
+# Work that the page doesn't need to wait for (e.g. recomputing indexes)
+background = ThreadPoolExecutor(max_workers=2, thread_name_prefix="background-job")
+
+
+def _log_background_error(future):
+    if future.exception() is not None:
+        logging.error(f"Background job failed: {future.exception()!r}")
+
+
+def submit_background(fn, *args):
+    future = background.submit(fn, *args)
+    future.add_done_callback(_log_background_error)
+    return future
+
+
 # Password Hashing
+@traced(category="bcrypt")
 def hash_password(password):
     return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode()
 
 
+@traced(category="bcrypt")
 def verify_password(password, hashed):
     return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
 
 
 # User Registration
+@traced(category="utils")
 def register_user(username, email, password):
     users_ref = db.collection("users")
     # Check if username already exists
-    query = users_ref.where("username", "==", username).limit(1).stream()
+    query = stream_query(
+        "users.query",
+        users_ref.where("username", "==", username).select(ID_ONLY).limit(1),
+    )
     if any(True for _ in query):
         return False, "Username already exists."
     # Check if email already exists
-    query = users_ref.where("email", "==", email).limit(1).stream()
+    query = stream_query(
+        "users.query", users_ref.where("email", "==", email).select(ID_ONLY).limit(1)
+    )
     if any(True for _ in query):
         return False, "Email already exists."
     # Hash the password
     password_hashed = hash_password(password)
     # Create user document with last_recitation_time initialized to None
+    now = datetime.datetime.now(datetime.timezone.utc)
     user_doc = {
         "username": username,
         "email": email,
         "password_hash": password_hashed,
-        "created_at": datetime.datetime.now(datetime.timezone.utc),
+        "created_at": now,
+        "updated_at": now,  # Bumped on every user write (export cursor)
         "last_recitation_time": None,  # Initialize as None
     }
-    users_ref.add(user_doc)
+    write("users.add", users_ref.add, user_doc)
     return True, "Registration successful."
 
 
 # User Login
+@traced(category="utils")
 def login_user(username, password):
     users_ref = db.collection("users")
-    query = users_ref.where("username", "==", username).limit(1).stream()
-    user = None
+    # The hash is only read here and never leaves this function
+    query = stream_query(
+        "users.query",
+        users_ref.where("username", "==", username)
+        .select(["password_hash", *User.FIELDS])
+        .limit(1),
+    )
+    user_doc = None
     for doc in query:
-        user = doc.to_dict()
-        user["id"] = doc.id
+        user_doc = doc
         break
-    if user and verify_password(password, user["password_hash"]):
-        return True, user
+    if user_doc and verify_password(password, user_doc.get("password_hash")):
+        return True, User.from_doc(user_doc)
     else:
         return False, "Invalid username or password."
 
 
 # Send Friend Request
+@traced(category="utils")
 def send_friend_request(from_user_id, to_username):
     users_ref = db.collection("users")
     # Get the to_user_id
-    query = users_ref.where("username", "==", to_username).limit(1).stream()
-    to_user = None
+    query = stream_query(
+        "users.query",
+        users_ref.where("username", "==", to_username).select(ID_ONLY).limit(1),
+    )
+    to_user_id = None
     for doc in query:
-        to_user = doc.to_dict()
-        to_user["id"] = doc.id
+        to_user_id = doc.id
         break
-    if not to_user:
+    if not to_user_id:
         return False, "User not found."
-    if to_user["id"] == from_user_id:
+    if to_user_id == from_user_id:
         return False, "You cannot send a friend request to yourself."
     # Check if a friendship already exists
     friendships_ref = db.collection("friendships")
-    friendship_query = (
-        friendships_ref.where("user1_id", "==", min(from_user_id, to_user["id"]))
-        .where("user2_id", "==", max(from_user_id, to_user["id"]))
-        .limit(1)
-        .stream()
+    friendship_query = stream_query(
+        "friendships.query",
+        friendships_ref.where("user1_id", "==", min(from_user_id, to_user_id))
+        .where("user2_id", "==", max(from_user_id, to_user_id))
+        .select(ID_ONLY)
+        .limit(1),
     )
     if any(True for _ in friendship_query):
         return False, "You are already friends."
     # Check if a friend request is already pending
     friend_requests_ref = db.collection("friend_requests")
-    request_query = (
+    request_query = stream_query(
+        "friend_requests.query",
         friend_requests_ref.where("from_user_id", "==", from_user_id)
-        .where("to_user_id", "==", to_user["id"])
+        .where("to_user_id", "==", to_user_id)
         .where("status", "==", "pending")
-        .limit(1)
-        .stream()
+        .select(ID_ONLY)
+        .limit(1),
     )
     if any(True for _ in request_query):
         return False, "Friend request already sent."
     # Create friend request
     friend_request_doc = {
         "from_user_id": from_user_id,
-        "to_user_id": to_user["id"],
+        "to_user_id": to_user_id,
         "status": "pending",
         "created_at": datetime.datetime.now(datetime.timezone.utc),
     }
-    friend_requests_ref.add(friend_request_doc)
+    write("friend_requests.add", friend_requests_ref.add, friend_request_doc)
+    cache.invalidate(count_pending_requests.cache_key(to_user_id))
     return True, "Friend request sent."
 
 
+# Get User Profile
+@traced(category="utils")
+@memoize(cache, "user", stale_ttl=STALE_TTL)
+def get_user(user_id):
+    user_doc = get_document(
+        "users.get", db.collection("users").document(user_id), User.FIELDS
+    )
+    if not user_doc.exists:
+        return None
+    return User.from_doc(user_doc)
+
+
 # Get Friend Requests for a User
+@traced(category="utils")
 def get_friend_requests(user_id):
     friend_requests_ref = db.collection("friend_requests")
-    query = (
+    query = stream_query(
+        "friend_requests.query",
         friend_requests_ref.where("to_user_id", "==", user_id)
         .where("status", "==", "pending")
-        .stream()
+        .select(FriendRequest.FIELDS),
     )
     requests = []
     for doc in query:
-        req = doc.to_dict()
-        req["id"] = doc.id
+        req = FriendRequest.from_doc(doc)
         # Get sender's username
-        sender = db.collection("users").document(req["from_user_id"]).get()
+        sender = get_document(
+            "users.get", db.collection("users").document(req.from_user_id), ["username"]
+        )
         if sender.exists:
-            req["from_username"] = sender.to_dict().get("username", "Unknown")
+            req.from_username = sender.to_dict().get("username", "Unknown")
         requests.append(req)
     return requests
 
 
 # Accept or Reject Friend Request
+@traced(category="utils")
 def respond_friend_request(request_id, accept=True):
     friend_requests_ref = db.collection("friend_requests").document(request_id)
     try:
-        request_doc = friend_requests_ref.get()
+        request_doc = get_document(
+            "friend_requests.get",
+            friend_requests_ref,
+            ["from_user_id", "to_user_id", "status"],
+        )
         if not request_doc.exists:
             return False, "Friend request not found."
         request_data = request_doc.to_dict()
@@ -157,7 +309,10 @@ def respond_friend_request(request_id, accept=True):
             return False, "Friend request already responded to."
         # Update the status
         new_status = "accepted" if accept else "rejected"
-        friend_requests_ref.update({"status": new_status})
+        write(
+            "friend_requests.update", friend_requests_ref.update, {"status": new_status}
+        )
+        cache.invalidate(count_pending_requests.cache_key(request_data["to_user_id"]))
         if accept:
             # Create friendship
             friendships_ref = db.collection("friendships")
@@ -176,7 +331,7 @@ def respond_friend_request(request_id, accept=True):
                     "user2_id": user1_id,
                     "created_at": datetime.datetime.now(datetime.timezone.utc),
                 }
-            friendships_ref.add(friendship_data)
+            write("friendships.add", friendships_ref.add, friendship_data)
             # Initialize streak with current_streak=0 and last_mutual_recitation=None
             streaks_ref = db.collection("streaks")
             streak_data = {
@@ -185,95 +340,155 @@ def respond_friend_request(request_id, accept=True):
                 "current_streak": 0,
                 "last_mutual_recitation": None,
                 "created_at": datetime.datetime.now(datetime.timezone.utc),
+                "updated_at": datetime.datetime.now(datetime.timezone.utc),
             }
-            streaks_ref.add(streak_data)
+            write("streaks.add", streaks_ref.add, streak_data)
+            # Both users now have a new friend and a new streak
+            cache.invalidate(
+                get_friends.cache_key(user1_id),
+                get_friends.cache_key(user2_id),
+                get_streaks.cache_key(user1_id),
+                get_streaks.cache_key(user2_id),
+                get_dashboard_stats.cache_key(user1_id),
+                get_dashboard_stats.cache_key(user2_id),
+            )
+            submit_background(update_suggestions_for_friendship, user1_id, user2_id)
         return True, f"Friend request {'accepted' if accept else 'rejected'}."
     except Exception as e:
         return False, str(e)
 
 
 # Get Friends List
+@traced(category="utils")
+@memoize(cache, "friends", stale_ttl=STALE_TTL)
 def get_friends(user_id):
     friendships_ref = db.collection("friendships")
     # Fetch friendships where user is user1
-    query1 = friendships_ref.where("user1_id", "==", user_id).stream()
+    query1 = stream_query(
+        "friendships.query",
+        friendships_ref.where("user1_id", "==", user_id).select(["user2_id"]),
+    )
     friends = []
     for doc in query1:
-        friendship = doc.to_dict()
-        friend_id = friendship["user2_id"]
-        friend_doc = db.collection("users").document(friend_id).get()
+        friend_id = doc.get("user2_id")
+        friend_doc = get_document(
+            "users.get", db.collection("users").document(friend_id), User.FIELDS
+        )
         if friend_doc.exists:
-            friend = friend_doc.to_dict()
-            friend["id"] = friend_doc.id
-            friends.append(friend)
+            friends.append(User.from_doc(friend_doc))
     # Fetch friendships where user is user2
-    query2 = friendships_ref.where("user2_id", "==", user_id).stream()
+    query2 = stream_query(
+        "friendships.query",
+        friendships_ref.where("user2_id", "==", user_id).select(["user1_id"]),
+    )
     for doc in query2:
-        friendship = doc.to_dict()
-        friend_id = friendship["user1_id"]
-        friend_doc = db.collection("users").document(friend_id).get()
+        friend_id = doc.get("user1_id")
+        friend_doc = get_document(
+            "users.get", db.collection("users").document(friend_id), User.FIELDS
+        )
         if friend_doc.exists:
-            friend = friend_doc.to_dict()
-            friend["id"] = friend_doc.id
-            friends.append(friend)
+            friends.append(User.from_doc(friend_doc))
     return friends
 
 
+# Recitation documents are keyed "{user_id}_{YYYYMMDD}" (UTC day), so each
+# user has at most one per day and it can be fetched without a query
+def recitation_day_key(moment=None):
+    moment = moment or datetime.datetime.now(datetime.timezone.utc)
+    return moment.astimezone(datetime.timezone.utc).strftime("%Y%m%d")
+
+
+def recitation_id(user_id, day_key):
+    return f"{user_id}_{day_key}"
+
+
+# Whether a user's recitation on a UTC day is fully recorded (a single read)
+@traced(category="utils")
+@memoize(cache, "recited", ttl=3600, stale_ttl=STALE_TTL)
+def has_recited_on(user_id, day_key):
+    doc = get_document(
+        "recitations.get",
+        db.collection("recitations").document(recitation_id(user_id, day_key)),
+        ["completed"],
+    )
+    return doc.exists and doc.to_dict().get("completed", True)
+
+
 # Mark Recitation
+@traced(category="utils")
 def mark_recitation(user_id):
-    recitations_ref = db.collection("recitations")
-    users_ref = db.collection("users").document(user_id)
-    # Get current timestamp as timezone-aware UTC datetime
     now = datetime.datetime.now(datetime.timezone.utc)
+    day_key = recitation_day_key(now)
+    recitation_ref = db.collection("recitations").document(
+        recitation_id(user_id, day_key)
+    )
+    # create() fails if today's document exists, so repeat clicks and other
+    # sessions stop after one write instead of redoing the friend/streak work
+    recitation_data = {
+        "user_id": user_id,
+        "date": now.replace(hour=0, minute=0, second=0, microsecond=0),  # UTC day
+        "recited_at": now,
+        "completed": False,  # Set once the updates below have all been applied
+    }
+    try:
+        try:
+            write("recitations.create", recitation_ref.create, recitation_data)
+        except google_exceptions.AlreadyExists:
+            # An earlier attempt may have failed, or timed out after its write
+            # landed, before finishing; the updates are safe to apply again
+            recitation_doc = get_document(
+                "recitations.get", recitation_ref, ["completed"]
+            )
+            if (recitation_doc.to_dict() or {}).get("completed", True):
+                return True, "You have already recited today."
+        _apply_recitation(user_id, now)
+        write("recitations.update", recitation_ref.update, {"completed": True})
+    except Exception as e:
+        logging.error(f"Error marking recitation for {user_id}: {e}")
+        return False, "Could not mark your recitation. Please try again."
+    finally:
+        cache.invalidate(has_recited_on.cache_key(user_id, day_key))
+    return True, "Recitation marked for today."
+
+
+# Update the user, streaks and circles for a recitation. Every step is
+# idempotent for the day, so an interrupted attempt can simply be rerun.
+def _apply_recitation(user_id, now):
+    users_ref = db.collection("users").document(user_id)
     # Update user's last_recitation_time
-    users_ref.update({"last_recitation_time": now})
+    write(
+        "users.update",
+        users_ref.update,
+        {"last_recitation_time": now, "updated_at": now},
+    )
     # Fetch user's friends
     friends = get_friends(user_id)
-    # Initialize list to track mutual friends
+    today = utc_day(now)
+    # Friends who also recited today (UTC) share a streak day with the user
     mutual_friends = []
-    # Loop through each friend to check their last_recitation_time
     for friend in friends:
-        friend_id = friend["id"]
-        friend_doc = db.collection("users").document(friend_id).get()
+        friend_id = friend.id
+        friend_doc = get_document(
+            "users.get",
+            db.collection("users").document(friend_id),
+            ["last_recitation_time"],
+        )
         if friend_doc.exists:
-            friend_data = friend_doc.to_dict()
-            friend_last_recitation = friend_data.get("last_recitation_time")
-            if friend_last_recitation:
-                # Ensure friend_last_recitation is timezone-aware
-                if friend_last_recitation.tzinfo is None:
-                    friend_last_recitation = friend_last_recitation.replace(
-                        tzinfo=datetime.timezone.utc
-                    )
-                time_diff = now - friend_last_recitation
-                if time_diff.total_seconds() <= 86400:  # 24 hours = 86400 seconds
-                    mutual_friends.append(friend_id)
-    # Create or update recitation record for today
-    # Firestore automatically handles datetime comparisons correctly
-    today_recitation_query = (
-        recitations_ref.where("user_id", "==", user_id)
-        .where("date", "==", now.date())
-        .limit(1)
-        .stream()
-    )
-    if not any(True for _ in today_recitation_query):
-        # Add recitation record
-        recitation_data = {
-            "user_id": user_id,
-            "date": now.date(),  # Store date only
-            "recited_at": now,
-        }
-        recitations_ref.add(recitation_data)
+            friend_last_recitation = friend_doc.to_dict().get("last_recitation_time")
+            if friend_last_recitation and utc_day(friend_last_recitation) == today:
+                mutual_friends.append(friend_id)
     # Update streaks with mutual friends
     streaks_ref = db.collection("streaks")
     for friend_id in mutual_friends:
         # Determine ordered user IDs
         ordered_ids = sorted([user_id, friend_id])
         # Query the streak document
-        streak_query = (
+        streak_query = stream_query(
+            "streaks.query",
             streaks_ref.where("user1_id", "==", ordered_ids[0])
             .where("user2_id", "==", ordered_ids[1])
-            .limit(1)
-            .stream()
+            .select(["current_streak", "longest_streak", "last_mutual_recitation"])
+            .limit(1),
         )
         streak_doc = None
         for doc in streak_query:
@@ -283,23 +498,27 @@ def mark_recitation(user_id):
             streak_data = streak_doc.to_dict()
             streak_id = streak_doc.id
             last_mutual = streak_data.get("last_mutual_recitation")
-            if last_mutual:
-                # Ensure last_mutual is timezone-aware
-                if last_mutual.tzinfo is None:
-                    last_mutual = last_mutual.replace(tzinfo=datetime.timezone.utc)
-                time_since_last = now - last_mutual
-                if time_since_last.total_seconds() <= 86400:
-                    # Increment streak
-                    new_streak = streak_data["current_streak"] + 1
-                else:
-                    # Reset streak
-                    new_streak = 1
+            if last_mutual and utc_day(last_mutual) == today:
+                # Today was already counted (by the friend, or an earlier try)
+                continue
+            if streak_is_current(last_mutual, now):
+                # The last mutual day was yesterday: extend the streak
+                new_streak = (streak_data.get("current_streak") or 0) + 1
             else:
-                # Initialize streak
+                # Start a new streak
                 new_streak = 1
             # Update streak document
-            streaks_ref.document(streak_id).update(
-                {"current_streak": new_streak, "last_mutual_recitation": now}
+            write(
+                "streaks.update",
+                streaks_ref.document(streak_id).update,
+                {
+                    "current_streak": new_streak,
+                    "longest_streak": max(
+                        new_streak, streak_data.get("longest_streak") or 0
+                    ),
+                    "last_mutual_recitation": now,
+                    "updated_at": now,
+                },
             )
         else:
             # If no streak document exists, create one
@@ -307,84 +526,614 @@ def mark_recitation(user_id):
                 "user1_id": ordered_ids[0],
                 "user2_id": ordered_ids[1],
                 "current_streak": 1,
+                "longest_streak": 1,
                 "last_mutual_recitation": now,
                 "created_at": datetime.datetime.now(datetime.timezone.utc),
+                "updated_at": now,
             }
-            streaks_ref.add(streak_data)
-    # Reset streaks with friends who haven't recited within 24 hours
+            write("streaks.add", streaks_ref.add, streak_data)
+    # Streaks with friends who haven't recited are not reset here: they stay
+    # current until a full UTC day passes, which get_streaks applies on read
+    # Count the recitation towards every circle the user belongs to
+    user = get_user(user_id)
+    for circle_id in user.circle_ids if user else ():
+        mark_circle_recitation(circle_id, user_id, now)
+    # The user's profile and streaks changed, and every friend's friend list
+    # and streaks embed this user's recitation state
+    stale_keys = [
+        get_user.cache_key(user_id),
+        get_streaks.cache_key(user_id),
+        get_dashboard_stats.cache_key(user_id),
+    ]
     for friend in friends:
-        friend_id = friend["id"]
-        if friend_id not in mutual_friends:
-            # Determine ordered user IDs
-            ordered_ids = sorted([user_id, friend_id])
-            # Query the streak document
-            streak_query = (
-                streaks_ref.where("user1_id", "==", ordered_ids[0])
-                .where("user2_id", "==", ordered_ids[1])
-                .limit(1)
-                .stream()
-            )
-            streak_doc = None
-            for doc in streak_query:
-                streak_doc = doc
-                break
-            if streak_doc:
-                streak_id = streak_doc.id
-                # Reset streak
-                streaks_ref.document(streak_id).update(
-                    {"current_streak": 0, "last_mutual_recitation": None}
-                )
-    return True, "Recitation marked for today."
+        stale_keys.append(get_friends.cache_key(friend.id))
+        stale_keys.append(get_streaks.cache_key(friend.id))
+        stale_keys.append(get_dashboard_stats.cache_key(friend.id))
+    cache.invalidate(*stale_keys)
 
 
 # Get Streaks
+@traced(category="utils")
+@memoize(cache, "streaks", ttl=60, stale_ttl=STALE_TTL)
 def get_streaks(user_id):
     streaks_ref = db.collection("streaks")
     # Fetch where user is user1
-    query1 = streaks_ref.where("user1_id", "==", user_id).stream()
+    query1 = stream_query(
+        "streaks.query",
+        streaks_ref.where("user1_id", "==", user_id).select(Streak.FIELDS),
+    )
     # Fetch where user is user2
-    query2 = streaks_ref.where("user2_id", "==", user_id).stream()
+    query2 = stream_query(
+        "streaks.query",
+        streaks_ref.where("user2_id", "==", user_id).select(Streak.FIELDS),
+    )
     streaks = []
     now = datetime.datetime.now(datetime.timezone.utc)
-    for doc in query1:
-        streak = doc.to_dict()
-        streak["id"] = doc.id
-        # Get friend's info
-        friend_id = streak["user2_id"]
-        friend_doc = db.collection("users").document(friend_id).get()
-        if friend_doc.exists:
-            streak["friend_username"] = friend_doc.to_dict().get("username", "Unknown")
-        # Check if streak is still active
-        last_mutual = streak.get("last_mutual_recitation")
-        if last_mutual:
-            if last_mutual.tzinfo is None:
-                last_mutual = last_mutual.replace(tzinfo=datetime.timezone.utc)
-            time_diff = now - last_mutual
-            if time_diff.total_seconds() > 86400:
-                # Streak expired
-                streak["current_streak"] = 0
-        streaks.append(streak)
-    for doc in query2:
-        streak = doc.to_dict()
-        streak["id"] = doc.id
+    for doc in query1 + query2:
+        streak = Streak.from_doc(doc, user_id)
         # Get friend's info
-        friend_id = streak["user1_id"]
-        friend_doc = db.collection("users").document(friend_id).get()
+        friend_doc = get_document(
+            "users.get", db.collection("users").document(streak.friend_id), ["username"]
+        )
         if friend_doc.exists:
-            streak["friend_username"] = friend_doc.to_dict().get("username", "Unknown")
+            streak.friend_username = friend_doc.to_dict().get("username", "Unknown")
         # Check if streak is still active
-        last_mutual = streak.get("last_mutual_recitation")
-        if last_mutual:
-            if last_mutual.tzinfo is None:
-                last_mutual = last_mutual.replace(tzinfo=datetime.timezone.utc)
-            time_diff = now - last_mutual
-            if time_diff.total_seconds() > 86400:
-                # Streak expired
-                streak["current_streak"] = 0
+        if not streak_is_current(streak.last_mutual_recitation, now):
+            # Streak expired
+            streak.current_streak = 0
         streaks.append(streak)
     return streaks
 
 
+# Stats
+# Counts and totals come from server-side aggregation queries (one
+# aggregation read each) instead of streaming documents, and are cached
+# briefly since badges and dashboard totals tolerate a little lag.
+STATS_TTL = 30
+FIRESTORE_IN_LIMIT = 30
+
+
+# Number of pending friend requests (sidebar badge)
+@traced(category="utils")
+@memoize(cache, "stats.pending", ttl=STATS_TTL, stale_ttl=STALE_TTL)
+def count_pending_requests(user_id):
+    query = (
+        db.collection("friend_requests")
+        .where("to_user_id", "==", user_id)
+        .where("status", "==", "pending")
+    )
+    return aggregate("friend_requests.count", query.count())
+
+
+# Dashboard totals
+@traced(category="utils")
+@memoize(cache, "stats.dashboard", ttl=STATS_TTL, stale_ttl=STALE_TTL)
+def get_dashboard_stats(user_id):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    yesterday_start = today_start - datetime.timedelta(days=1)
+    month_start = today_start.replace(day=1)
+    recitations_ref = db.collection("recitations")
+    streaks_ref = db.collection("streaks")
+    stats = {
+        "total_recitations": aggregate(
+            "recitations.count",
+            recitations_ref.where("user_id", "==", user_id).count(),
+        ),
+        "recitations_this_month": aggregate(
+            "recitations.count",
+            recitations_ref.where("user_id", "==", user_id)
+            .where("recited_at", ">=", month_start)
+            .count(),
+        ),
+        # Only streaks still current (last mutual day today or yesterday),
+        # matching the expiry get_streaks applies to the list
+        "streak_days": aggregate(
+            "streaks.sum",
+            streaks_ref.where("user1_id", "==", user_id)
+            .where("last_mutual_recitation", ">=", yesterday_start)
+            .sum("current_streak"),
+        )
+        + aggregate(
+            "streaks.sum",
+            streaks_ref.where("user2_id", "==", user_id)
+            .where("last_mutual_recitation", ">=", yesterday_start)
+            .sum("current_streak"),
+        ),
+        "friends_reciting_today": 0,
+    }
+    # 'in' filters take at most 30 values, so count friends in chunks
+    friend_refs = [
+        db.collection("users").document(friend.id) for friend in get_friends(user_id)
+    ]
+    for start in range(0, len(friend_refs), FIRESTORE_IN_LIMIT):
+        chunk = friend_refs[start : start + FIRESTORE_IN_LIMIT]
+        stats["friends_reciting_today"] += aggregate(
+            "users.count",
+            db.collection("users")
+            .where(firestore.FieldPath.document_id(), "in", chunk)
+            .where("last_recitation_time", ">=", today_start)
+            .count(),
+        )
+    return stats
+
+
+# Friend Suggestions
+# Each user has a suggestions/{user_id}/candidates subcollection with one
+# document per candidate holding their username and mutual-friend count. A
+# background job updates it incrementally whenever a friendship is created,
+# so the Friends page reads the top few candidates instead of walking the
+# friend graph, and no single document grows with the user's network.
+SUGGESTIONS_SHOWN = 10
+MAX_BATCH_WRITES = 500
+
+
+def _candidates_ref(user_id):
+    return db.collection("suggestions").document(user_id).collection("candidates")
+
+
+def _suggestion_entry(candidate):
+    return {"username": candidate.username, "mutual": firestore.Increment(1)}
+
+
+# Commit (doc_ref, data) pairs in batches; data None deletes the document
+def _commit_in_batches(writes):
+    for start in range(0, len(writes), MAX_BATCH_WRITES):
+        batch = db.batch()
+        for doc_ref, data in writes[start : start + MAX_BATCH_WRITES]:
+            if data is None:
+                batch.delete(doc_ref)
+            else:
+                batch.set(doc_ref, data, merge=True)
+        write("suggestions.commit", batch.commit)
+
+
+# Apply a new friendship between user_a and user_b to the suggestion index
+@traced(category="utils")
+def update_suggestions_for_friendship(user_a_id, user_b_id):
+    user_a = get_user(user_a_id)
+    user_b = get_user(user_b_id)
+    if not user_a or not user_b:
+        return
+    friends_a = get_friends(user_a_id)
+    friends_b = get_friends(user_b_id)
+    friend_ids_a = {friend.id for friend in friends_a}
+    friend_ids_b = {friend.id for friend in friends_b}
+    writes = []
+    # Every other friend of one user now shares a mutual friend with the other
+    for new_friend, friends, other_friend_ids in (
+        (user_b, friends_a, friend_ids_b),
+        (user_a, friends_b, friend_ids_a),
+    ):
+        for friend in friends:
+            if friend.id == new_friend.id or friend.id in other_friend_ids:
+                continue
+            writes.append(
+                (
+                    _candidates_ref(new_friend.id).document(friend.id),
+                    _suggestion_entry(friend),
+                )
+            )
+            writes.append(
+                (
+                    _candidates_ref(friend.id).document(new_friend.id),
+                    _suggestion_entry(new_friend),
+                )
+            )
+    # The two users are friends now, so stop suggesting them to each other
+    for user_id, candidate_id in ((user_a_id, user_b_id), (user_b_id, user_a_id)):
+        writes.append((_candidates_ref(user_id).document(candidate_id), None))
+    _commit_in_batches(writes)
+    cache.invalidate(
+        *{get_suggestions.cache_key(doc_ref.parent.parent.id) for doc_ref, _ in writes}
+    )
+
+
+# Recompute a user's suggestions from scratch (backfill for existing users)
+@traced(category="utils")
+def rebuild_suggestions(user_id):
+    friends = get_friends(user_id)
+    friend_ids = {friend.id for friend in friends}
+    candidates = {}
+    for friend in friends:
+        for candidate in get_friends(friend.id):
+            if candidate.id == user_id or candidate.id in friend_ids:
+                continue
+            entry = candidates.setdefault(
+                candidate.id, {"username": candidate.username, "mutual": 0}
+            )
+            entry["mutual"] += 1
+    candidates_ref = _candidates_ref(user_id)
+    existing = stream_query("suggestions.query", candidates_ref.select(ID_ONLY))
+    writes = [
+        (candidates_ref.document(doc.id), None)
+        for doc in existing
+        if doc.id not in candidates
+    ]
+    # Plain values overwrite the counts instead of incrementing them
+    for candidate_id, entry in candidates.items():
+        writes.append((candidates_ref.document(candidate_id), entry))
+    _commit_in_batches(writes)
+    # Also drops the candidates map older versions kept on this document
+    write(
+        "suggestions.set",
+        db.collection("suggestions").document(user_id).set,
+        {"updated_at": datetime.datetime.now(datetime.timezone.utc)},
+    )
+    cache.invalidate(get_suggestions.cache_key(user_id))
+
+
+# Rebuild suggestions for the given users, or for every user
+def rebuild_all_suggestions(user_ids=None):
+    if not user_ids:
+        users = stream_query("users.query", db.collection("users").select(ID_ONLY))
+        user_ids = [doc.id for doc in users]
+    for count, user_id in enumerate(user_ids, start=1):
+        rebuild_suggestions(user_id)
+        if count % 100 == 0:
+            print(f"Rebuilt suggestions for {count} of {len(user_ids)} users.")
+    return len(user_ids)
+
+
+# People you may know, ranked by mutual friends (reads SUGGESTIONS_SHOWN docs)
+@traced(category="utils")
+@memoize(cache, "suggestions", stale_ttl=STALE_TTL)
+def get_suggestions(user_id):
+    query = stream_query(
+        "suggestions.query",
+        _candidates_ref(user_id)
+        .order_by("mutual", direction=firestore.Query.DESCENDING)
+        .limit(SUGGESTIONS_SHOWN),
+    )
+    suggestions = []
+    for doc in query:
+        entry = doc.to_dict()
+        if entry.get("mutual", 0) > 0:
+            suggestions.append(
+                Suggestion(doc.id, entry.get("username", "Unknown"), entry["mutual"])
+            )
+    return suggestions
+
+
+# Recitation Circles
+# A circle tracks a group streak: a day counts when every member recited.
+# Each day is stored as a bitmask of the members who recited (bit i is
+# member_ids[i]), so a recitation is one read and one write per circle.
+MAX_CIRCLE_MEMBERS = 63  # Firestore integers are signed 64-bit
+CIRCLE_DAYS_KEPT = 7
+
+
+def circle_day_key(moment):
+    return moment.strftime("%Y%m%d")
+
+
+# Create a Circle
+@traced(category="utils")
+def create_circle(owner_id, name):
+    owner = get_user(owner_id)
+    if not owner:
+        return False, "User not found."
+    circle_doc = {
+        "name": name,
+        "owner_id": owner_id,
+        "member_ids": [owner_id],
+        "member_usernames": {owner_id: owner.username},
+        "days": {},
+        "current_streak": 0,
+        "longest_streak": 0,
+        "last_complete_day": None,
+        "created_at": datetime.datetime.now(datetime.timezone.utc),
+    }
+    _, circle_ref = write("circles.add", db.collection("circles").add, circle_doc)
+    write(
+        "users.update",
+        db.collection("users").document(owner_id).update,
+        {
+            "circle_ids": firestore.ArrayUnion([circle_ref.id]),
+            "updated_at": datetime.datetime.now(datetime.timezone.utc),
+        },
+    )
+    cache.invalidate(get_user.cache_key(owner_id))
+    return True, f"Circle '{name}' created."
+
+
+# Invite a User to a Circle (the invitee has to accept, like friend requests)
+@traced(category="utils")
+def invite_circle_member(circle_id, inviter_id, username):
+    users_ref = db.collection("users")
+    query = stream_query(
+        "users.query",
+        users_ref.where("username", "==", username).select(ID_ONLY).limit(1),
+    )
+    invitee_doc = next(iter(query), None)
+    if invitee_doc is None:
+        return False, "User not found."
+    circle_doc = get_document(
+        "circles.get",
+        db.collection("circles").document(circle_id),
+        ["name", "member_ids"],
+    )
+    if not circle_doc.exists:
+        return False, "Circle not found."
+    circle = circle_doc.to_dict()
+    if inviter_id not in circle["member_ids"]:
+        return False, "Only circle members can invite people."
+    if invitee_doc.id in circle["member_ids"]:
+        return False, "User is already in this circle."
+    if len(circle["member_ids"]) >= MAX_CIRCLE_MEMBERS:
+        return False, f"Circles are limited to {MAX_CIRCLE_MEMBERS} members."
+    invites_ref = db.collection("circle_invites")
+    invite_query = stream_query(
+        "circle_invites.query",
+        invites_ref.where("circle_id", "==", circle_id)
+        .where("to_user_id", "==", invitee_doc.id)
+        .where("status", "==", "pending")
+        .select(ID_ONLY)
+        .limit(1),
+    )
+    if any(True for _ in invite_query):
+        return False, "Invite already sent."
+    invite_doc = {
+        "circle_id": circle_id,
+        "circle_name": circle["name"],
+        "from_user_id": inviter_id,
+        "to_user_id": invitee_doc.id,
+        "status": "pending",
+        "created_at": datetime.datetime.now(datetime.timezone.utc),
+    }
+    write("circle_invites.add", invites_ref.add, invite_doc)
+    return True, f"Invite sent to {username}."
+
+
+# Get pending Circle Invites for a User
+@traced(category="utils")
+def get_circle_invites(user_id):
+    query = stream_query(
+        "circle_invites.query",
+        db.collection("circle_invites")
+        .where("to_user_id", "==", user_id)
+        .where("status", "==", "pending")
+        .select(["circle_id", "circle_name", "from_user_id"]),
+    )
+    invites = []
+    for doc in query:
+        invite = doc.to_dict()
+        invite["id"] = doc.id
+        sender = get_user(invite["from_user_id"])
+        invite["from_username"] = sender.username if sender else "Unknown"
+        invites.append(invite)
+    return invites
+
+
+@firestore.transactional
+def _add_circle_member(transaction, circle_ref, member_id, username):
+    snapshot = circle_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        return False, "Circle not found."
+    circle = snapshot.to_dict()
+    if member_id in circle["member_ids"]:
+        return False, "You are already in this circle."
+    if len(circle["member_ids"]) >= MAX_CIRCLE_MEMBERS:
+        return False, f"Circles are limited to {MAX_CIRCLE_MEMBERS} members."
+    # New members take the next bit, so existing day masks stay valid
+    transaction.update(
+        circle_ref,
+        {
+            "member_ids": circle["member_ids"] + [member_id],
+            f"member_usernames.{member_id}": username,
+        },
+    )
+    return True, f"You joined {circle['name']}."
+
+
+# Accept or Decline a Circle Invite
+@traced(category="utils")
+def respond_circle_invite(invite_id, user_id, accept=True):
+    invite_ref = db.collection("circle_invites").document(invite_id)
+    invite_doc = get_document(
+        "circle_invites.get", invite_ref, ["circle_id", "to_user_id", "status"]
+    )
+    if not invite_doc.exists:
+        return False, "Invite not found."
+    invite = invite_doc.to_dict()
+    if invite["to_user_id"] != user_id:
+        return False, "Invite not found."
+    if invite["status"] != "pending":
+        return False, "Invite already responded to."
+    if not accept:
+        write("circle_invites.update", invite_ref.update, {"status": "declined"})
+        return True, "Invite declined."
+    user = get_user(user_id)
+    if not user:
+        return False, "User not found."
+    circle_id = invite["circle_id"]
+    success, message = _add_circle_member(
+        db.transaction(),
+        db.collection("circles").document(circle_id),
+        user_id,
+        user.username,
+    )
+    if not success:
+        return False, message
+    write("circle_invites.update", invite_ref.update, {"status": "accepted"})
+    write(
+        "users.update",
+        db.collection("users").document(user_id).update,
+        {
+            "circle_ids": firestore.ArrayUnion([circle_id]),
+            "updated_at": datetime.datetime.now(datetime.timezone.utc),
+        },
+    )
+    cache.invalidate(get_user.cache_key(user_id))
+    return True, message
+
+
+# Drop bit `index` from a day mask, shifting later members down one place
+def _remove_mask_bit(mask, index):
+    low = mask & ((1 << index) - 1)
+    return low | ((mask >> (index + 1)) << index)
+
+
+# Streak fields to update when `mask` covers every member on day_key
+def _completed_day_update(circle, mask, member_count, now):
+    if member_count == 0 or mask != (1 << member_count) - 1:
+        return {}
+    day_key = circle_day_key(now)
+    if circle.get("last_complete_day") == day_key:
+        return {}
+    yesterday_key = circle_day_key(now - datetime.timedelta(days=1))
+    if circle.get("last_complete_day") == yesterday_key:
+        current_streak = circle.get("current_streak", 0) + 1
+    else:
+        current_streak = 1
+    return {
+        "current_streak": current_streak,
+        "longest_streak": max(current_streak, circle.get("longest_streak", 0)),
+        "last_complete_day": day_key,
+    }
+
+
+@firestore.transactional
+def _remove_circle_member(transaction, circle_ref, user_id, now):
+    snapshot = circle_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        return False, "Circle not found."
+    circle = snapshot.to_dict()
+    member_ids = circle["member_ids"]
+    if user_id not in member_ids:
+        return False, "You are not in this circle."
+    index = member_ids.index(user_id)
+    remaining = member_ids[:index] + member_ids[index + 1 :]
+    if not remaining:
+        transaction.delete(circle_ref)
+        return True, f"You left {circle['name']}."
+    # Later members move down one bit to stay aligned with member_ids
+    days = {
+        key: _remove_mask_bit(mask, index)
+        for key, mask in circle.get("days", {}).items()
+    }
+    update = {
+        "member_ids": remaining,
+        f"member_usernames.{user_id}": firestore.DELETE_FIELD,
+        "days": days,
+    }
+    if circle.get("owner_id") == user_id:
+        update["owner_id"] = remaining[0]
+    # The remaining members may all have recited today already
+    update.update(
+        _completed_day_update(
+            circle, days.get(circle_day_key(now), 0), len(remaining), now
+        )
+    )
+    transaction.update(circle_ref, update)
+    return True, f"You left {circle['name']}."
+
+
+# Leave a Circle
+@traced(category="utils")
+def leave_circle(circle_id, user_id):
+    success, message = _remove_circle_member(
+        db.transaction(),
+        db.collection("circles").document(circle_id),
+        user_id,
+        datetime.datetime.now(datetime.timezone.utc),
+    )
+    if success:
+        write(
+            "users.update",
+            db.collection("users").document(user_id).update,
+            {
+                "circle_ids": firestore.ArrayRemove([circle_id]),
+                "updated_at": datetime.datetime.now(datetime.timezone.utc),
+            },
+        )
+        cache.invalidate(get_user.cache_key(user_id))
+    return success, message
+
+
+@firestore.transactional
+def _record_circle_recitation(transaction, circle_ref, user_id, now):
+    snapshot = circle_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        return
+    circle = snapshot.to_dict()
+    member_ids = circle["member_ids"]
+    if user_id not in member_ids:
+        return
+    day_key = circle_day_key(now)
+    days = circle.get("days", {})
+    bit = 1 << member_ids.index(user_id)
+    mask = days.get(day_key, 0)
+    if mask & bit:
+        return  # Already counted today
+    mask |= bit
+    update = {f"days.{day_key}": mask}
+    # Count the day once everyone has recited
+    update.update(_completed_day_update(circle, mask, len(member_ids), now))
+    # Drop day masks that can no longer affect the streak
+    oldest_key = circle_day_key(now - datetime.timedelta(days=CIRCLE_DAYS_KEPT))
+    for key in days:
+        if key < oldest_key:
+            update[f"days.{key}"] = firestore.DELETE_FIELD
+    transaction.update(circle_ref, update)
+
+
+# Record a member's recitation in one circle
+@traced(category="utils")
+def mark_circle_recitation(circle_id, user_id, now=None):
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    circle_ref = db.collection("circles").document(circle_id)
+    _record_circle_recitation(db.transaction(), circle_ref, user_id, now)
+
+
+def _circle_view(circle_doc, now):
+    circle = circle_doc.to_dict()
+    circle["id"] = circle_doc.id
+    today_key = circle_day_key(now)
+    yesterday_key = circle_day_key(now - datetime.timedelta(days=1))
+    today_mask = circle.get("days", {}).get(today_key, 0)
+    circle["members"] = [
+        {
+            "id": member_id,
+            "username": circle["member_usernames"].get(member_id, "Unknown"),
+            "recited_today": bool(today_mask & (1 << index)),
+        }
+        for index, member_id in enumerate(circle["member_ids"])
+    ]
+    # The streak is broken once a full day passes without everyone reciting
+    if circle.get("last_complete_day") not in (today_key, yesterday_key):
+        circle["current_streak"] = 0
+    return circle
+
+
+# Get a Circle (a single read)
+@traced(category="utils")
+def get_circle(circle_id):
+    circle_doc = get_document(
+        "circles.get", db.collection("circles").document(circle_id)
+    )
+    if not circle_doc.exists:
+        return None
+    return _circle_view(circle_doc, datetime.datetime.now(datetime.timezone.utc))
+
+
+# Get all Circles of a User
+@traced(category="utils")
+def get_circles(user_id):
+    user = get_user(user_id)
+    if not user or not user.circle_ids:
+        return []
+    now = datetime.datetime.now(datetime.timezone.utc)
+    circle_refs = [
+        db.collection("circles").document(circle_id) for circle_id in user.circle_ids
+    ]
+    return [
+        _circle_view(circle_doc, now)
+        for circle_doc in get_documents("circles.get", circle_refs)
+        if circle_doc.exists
+    ]
+
+
 # Authentication Token Management
 
 
@@ -394,6 +1143,7 @@ def generate_auth_token():
 
 
 # Function to create a token for a user and store it in Firestore
+@traced(category="utils")
 def create_auth_token(user_id):
     tokens_ref = db.collection("auth_tokens")
     token = generate_auth_token()
@@ -404,35 +1154,57 @@ def create_auth_token(user_id):
         "expires_at": datetime.datetime.now(datetime.timezone.utc)
         + datetime.timedelta(days=30),  # Token valid for 30 days
     }
-    tokens_ref.add(token_data)
+    write("auth_tokens.add", tokens_ref.add, token_data)
     return token
 
 
-def verify_auth_token(token):
+@memoize(cache, "auth_token", stale_ttl=STALE_TTL)
+def lookup_auth_token(token):
     tokens_ref = db.collection("auth_tokens")
+    query = stream_query(
+        "auth_tokens.query",
+        tokens_ref.where("token", "==", token)
+        .where("expires_at", ">", datetime.datetime.now(datetime.timezone.utc))
+        .select(["user_id"])
+        .limit(1),
+    )
+    for doc in query:
+        return doc.get("user_id")
+    return None
+
+
+@traced(category="utils")
+def verify_auth_token(token):
     try:
-        query = (
-            tokens_ref.where("token", "==", token)
-            .where("expires_at", ">", datetime.datetime.now(datetime.timezone.utc))
-            .limit(1)
-            .stream()
-        )
-        for doc in query:
-            token_data = doc.to_dict()
-            return token_data.get("user_id")
+        return lookup_auth_token(token)
     except Exception as e:
+        # Retries and the cached fallback are exhausted; treat as logged out
         logging.error(f"Error verifying auth token: {e}")
-        st.error(
-            f"An error occurred while verifying your session. Please try logging in again. {e}"
-        )
     return None
 
 
 # Function to delete a token (e.g., on logout)
+@traced(category="utils")
 def delete_auth_token(token):
     tokens_ref = db.collection("auth_tokens")
-    query = tokens_ref.where("token", "==", token).limit(1).stream()
+    query = stream_query(
+        "auth_tokens.query",
+        tokens_ref.where("token", "==", token).select(ID_ONLY).limit(1),
+    )
     for doc in query:
-        tokens_ref.document(doc.id).delete()
+        write("auth_tokens.delete", tokens_ref.document(doc.id).delete)
+        cache.invalidate(lookup_auth_token.cache_key(token))
         return True
     return False
+
+
+# Maintenance commands, run with the app's secrets (.streamlit/secrets.toml):
+#   python utils.py rebuild-suggestions            # every user
+#   python utils.py rebuild-suggestions USER_ID...  # selected users
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quran Recitation Tracker jobs.")
+    parser.add_argument("command", choices=["rebuild-suggestions"])
+    parser.add_argument("user_ids", nargs="*", help="Users to rebuild (default: all)")
+    args = parser.parse_args()
+    total = rebuild_all_suggestions(args.user_ids)
+    print(f"Rebuilt suggestions for {total} users.")